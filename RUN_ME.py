@@ -1,157 +1,147 @@
-import folium
-from folium.plugins import MarkerCluster
-import geopandas as gpd
-import numpy as np
-from flask import Flask, render_template
-
-def get_data():
-    import get_data
-
-def make_isochrone_layers(isochrone_data):
-    _5min_isos = isochrone_data[isochrone_data['value']==300]
-    _7min_isos = isochrone_data[isochrone_data['value']==420]
-    _10min_isos = isochrone_data[isochrone_data['value']==600]
-
-    _5min_layer = _5min_isos.unary_union
-    #_7min_layer = gpd.overlay(_7min_isos, _5min_isos, how='difference').unary_union
-    _7min_layer = _7min_isos.unary_union
-    #_10min_layer = gpd.overlay(_10min_isos, _7min_isos, how='difference').unary_union
-    _10min_layer = _10min_isos.unary_union
-
-    return {'5min':_5min_layer, '7min':_7min_layer, '10min':_10min_layer}
-
-def make_market_map(market_data, isochrone_data):
-
-    m = folium.Map(location=[40.728783, -73.992320],
-                  tiles = basemap,
-                  zoom_start=11)
-
-    #Creating Clusters of Market Locations
-    market_clusters = MarkerCluster(name='Markets')
-    for geom, name in zip(market_data['geometry'], market_data['name']):
-        folium.Marker(location = [geom.y, geom.x],
-                     popup = name,
-                     icon = folium.Icon(prefix='fa', icon='apple',
-                                        color='white', icon_color='red')).add_to(market_clusters)
-
-    m.add_child(market_clusters)
-
-    isochron_layers = folium.map.FeatureGroup(name='Walking Time')
-    m.add_child(isochron_layers)
-
-    _10min = folium.plugins.FeatureGroupSubGroup(isochron_layers, '10 min.')
-    m.add_child(_10min)
-
-    _7min = folium.plugins.FeatureGroupSubGroup(isochron_layers, '7 min.')
-    m.add_child(_7min)
-
-    _5min = folium.plugins.FeatureGroupSubGroup(isochron_layers, '5 min.')
-    m.add_child(_5min)
-
-
-    _10min.add_child(folium.GeoJson(isochrone_data['10min'], name='10 min.', style_function = lambda x:
-                                    {'fillColor': '#FE9B5B',
-                                     'fillOpacity': 0.5,
-                                     'weight': 1,
-                                     'color': 'black'
-                                    }))
-    _7min.add_child(folium.GeoJson(isochrone_data['7min'], name='7 min.', style_function = lambda x:
-                                    {'fillColor': '#FEEB7D',
-                                     'fillOpacity': 0.5,
-                                     'weight': 1,
-                                     'color': 'black'
-                                    }))
-    _5min.add_child(folium.GeoJson(isochrone_data['5min'], name='5 min.', style_function = lambda x:
-                                    {'fillColor': '#CFFF91',
-                                     'fillOpacity': 0.5,
-                                     'weight': 1,
-                                     'color': 'black'
-                                    }))
-
-    folium.LayerControl(autoZIndex=True, hideSingleBase="true").add_to(m)
-
-    return m
-
-
-def make_tract_map(market_data, tract_data):
-    m = folium.Map(location=[40.728783, -73.992320], tiles = basemap, zoom_start=11)
-
-    #Creating Clusters of Market Locations
-    market_clusters = MarkerCluster(name='Markets')
-    for geom, name in zip(market_data['geometry'], market_data['name']):
-        folium.Marker(location = [geom.y, geom.x],
-                     popup = name,
-                     icon = folium.Icon(prefix='fa', icon='apple',
-                                        color='white', icon_color='red')).add_to(market_clusters)
-
-    m.add_child(market_clusters)
-
-
-    folium.features.Choropleth(name='Median Income',
-                               geo_data='Geospatial_Data/NYC_Tracts_Clipped.geojson',
-                               data=tract_data, columns=['GEOID', 'B19049_001E'],
-                               key_on='feature.properties.GEOID',
-                               fill_color='Greens', legend_name='Median Income ($)').add_to(m)
-
-    folium.features.Choropleth(name='Pct. Population Nonwhite',
-                               geo_data='Geospatial_Data/NYC_Tracts_Clipped.geojson',
-                               data=tract_data, columns=['GEOID', 'pct_nonwhite'],
-                               key_on='feature.properties.GEOID',
-                               fill_color='Blues', show=False, legend_name='Pct. Nonwhite').add_to(m)
-
-    folium.features.Choropleth(name='Median Age',
-                               geo_data='Geospatial_Data/NYC_Tracts_Clipped.geojson',
-                               data=tract_data, columns=['GEOID', 'B01002_001E'],
-                               key_on='feature.properties.GEOID',
-                               fill_color='Oranges', show=False, legend_name='Median Age').add_to(m)
-
-
-    folium.LayerControl(autoZIndex=True, hideSingleBase="true").add_to(m)
-
-    return m
-
-
-def prompt_data_refresh():
-    while True:
-        response = input("Obtain fresh data? Y/N")
-        if response.lower() == 'y':
-            get_data()
-            break
-        elif response.lower() == 'n':
-            break
-        else:
-            print("Please enter 'Y' or 'N'")
-
-    pass
-
-
-if __name__ == '__main__':
-    prompt_data_refresh()
-
-    basemap = 'cartodbpositron'
-
+#Imports
+import argparse
+import json
+import os
+import sys
+
+#Heavy modules (pandas, geopandas, folium) are imported by the commands that need them,
+#so that serving prebuilt maps starts quickly
+
+BUILD_MANIFEST_PATH = 'static/build_manifest.json'
+BUILD_INPUTS = [f'Geospatial_Data/{layer}.{extension}'
+                for layer in ['markets', 'isochrones', 'Tracts_with_Data', 'NYC_Tracts_Clipped']
+                for extension in ['parquet', 'geojson']] + ['Geospatial_Data/isochrone_unions.parquet']
+BUILD_OUTPUTS = ['static/tracts.html', 'static/markets.html']
+
+#The stages of get_data.build_pipeline and build_maps.build_maps, listed here so
+#that arguments can be checked without importing either module
+FETCH_STAGES = ['markets', 'isochrones', 'tracts', 'access', 'nearest']
+BUILD_STAGES = ['isochrone_layers', 'tract_map', 'market_map']
+
+
+def get_data(force=(), force_all=False, profile=()):
+    from get_data import run_pipeline
+    run_pipeline(force=force, force_all=force_all, profile=profile)
+
+
+def input_signatures():
+    '''
+        Returns the modification time and size of each file the maps are built from.
+        '''
+    signatures = {}
+    for path in BUILD_INPUTS:
+        try:
+            stat = os.stat(path)
+            signatures[path] = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            signatures[path] = None
+
+    return signatures
+
+
+def maps_current(detail=None):
+    '''
+        Returns True if the maps in static/ were built from the current data
+        (and, if detail is given, at that level of detail).
+        '''
     try:
-        markets = gpd.read_file('Geospatial_Data/markets.geojson')
-    except:
+        with open(BUILD_MANIFEST_PATH, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return False
+
+    return (manifest.get('inputs') == input_signatures()
+            and (detail is None or manifest.get('detail') == detail)
+            and all(os.path.exists(path) and os.path.exists(path + '.gz') for path in BUILD_OUTPUTS))
+
+
+def build(detail='medium', force=False, profile=()):
+    '''
+        Builds the maps, unless they are already current or force is True,
+        writing a report of the build to Cache/reports/build.json. Build
+        stages named in profile are run under cProfile.
+        '''
+    if not os.path.exists('Geospatial_Data/markets.geojson'):
         print("No data found! Refreshing data -- please wait.")
         get_data()
-        markets = gpd.read_file('Geospatial_Data/markets.geojson')
-
-    isochrones = gpd.read_file('Geospatial_Data/isochrones.geojson')
-    isochrone_data = make_isochrone_layers(isochrones)
 
-    tracts = gpd.read_file('Geospatial_Data/Tracts_with_Data.geojson')
-    tracts[tracts.columns[12:22]] = tracts[tracts.columns[12:22]].astype(float)
-    tracts[tracts.columns[22]] = tracts[tracts.columns[22]]*100
+    if not force and maps_current(detail):
+        print("Maps are up to date.")
+        return
 
-    make_tract_map(markets, tracts).save('static/tracts.html')
-    make_market_map(markets, isochrone_data).save('static/markets.html')
+    from build_maps import build_maps
+    from instrumentation import RECORDER, timed
+    from webapp import precompress
 
-    #Flask starts here
-    app = Flask(__name__)
+    RECORDER.reset()
+    try:
+        build_maps(detail=detail, profile=profile)
+        with timed('maps.precompress'):
+            precompress(BUILD_OUTPUTS)
+    finally:
+        print(f"Build report saved to {RECORDER.write_report('build')}")
+
+    with open(BUILD_MANIFEST_PATH, 'w') as manifest_file:
+        json.dump({'detail': detail, 'inputs': input_signatures()}, manifest_file, indent=2)
+
+
+def serve(host='127.0.0.1', port=5000, workers=1):
+    '''
+        Serves the maps with Flask's development server or, if workers is
+        greater than 1, under gunicorn with that many worker processes.
+        '''
+    if workers > 1:
+        os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+                                   '--bind', f'{host}:{port}', 'webapp:create_app()'])
+
+    from webapp import create_app
+    create_app().run(host=host, port=port, debug=False, threaded=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Map food access in New York City.')
+    commands = parser.add_subparsers(dest='command')
+
+    fetch_parser = commands.add_parser('fetch', help='fetch and process data')
+    fetch_parser.add_argument('--force', nargs='+', default=[], metavar='STAGE', choices=FETCH_STAGES,
+                              help=f"re-run these pipeline stages ({', '.join(FETCH_STAGES)}) even if "
+                                   'their inputs are unchanged; forcing markets re-downloads them from Overpass')
+    fetch_parser.add_argument('--all', action='store_true', help='re-run every stage')
+    fetch_parser.add_argument('--profile', nargs='+', default=[], metavar='STAGE', choices=FETCH_STAGES,
+                              help='run these stages under cProfile, saving Cache/reports/<stage>.prof')
+
+    build_parser = commands.add_parser('build', help='build the static maps')
+    build_parser.add_argument('--detail', choices=['low', 'medium', 'high'], default='medium',
+                              help='the level of geometric detail in the maps')
+    build_parser.add_argument('--force', action='store_true',
+                              help='rebuild the maps even if the data are unchanged')
+    build_parser.add_argument('--profile', nargs='+', default=[], metavar='STAGE',
+                              choices=BUILD_STAGES,
+                              help='run these build stages under cProfile, saving Cache/reports/<stage>.prof')
+
+    serve_parser = commands.add_parser('serve', help='serve the maps, building them first if the '
+                                                     'data have changed since they were built')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=5000)
+    serve_parser.add_argument('--workers', type=int, default=1,
+                              help='serve with this many gunicorn worker processes')
+
+    return parser.parse_args(argv)
 
-    @app.route('/')
-    def index():
-        return render_template('index.html')
 
-    app.run(debug=False)
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.command == 'fetch':
+        get_data(force=args.force, force_all=args.all, profile=args.profile)
+    elif args.command == 'build':
+        build(detail=args.detail, force=args.force, profile=args.profile)
+    elif args.command == 'serve':
+        if not maps_current():
+            build()
+        serve(host=args.host, port=args.port, workers=args.workers)
+    else:
+        #With no command, fetch data if there are none, build the maps if stale, and serve them
+        if not maps_current():
+            build()
+        serve()
@@ -0,0 +1,121 @@
+#Imports
+import numpy as np
+import pandas as pd
+import shapely
+
+import map_db
+from isochrone_unions import RANGES, as_layers, load_or_build_unions
+
+
+#NAD83 / New York Long Island (ftUS), for area calculations within the city
+PROJECTED_CRS = 'epsg:2263'
+
+
+def coverage_shares(tract_geoms, coverage_geom):
+    '''
+        Returns the share of each tract's area lying within a coverage geometry.
+
+        The coverage is split into its parts, candidate tract/part pairs are
+        found with an STRtree, and intersection areas are computed for all
+        pairs at once.
+
+        Parameters
+        ----------
+        tract_geoms: ndarray
+            Tract polygons, in a projected CRS.
+
+        coverage_geom: Geometry
+            A polygon or multipolygon whose parts do not overlap, in the same CRS.
+
+
+        Returns
+        -------
+        ndarray
+            Shares between 0 and 1, aligned with tract_geoms.
+        '''
+    parts = shapely.get_parts(coverage_geom)
+    if len(parts) == 0:
+        return np.zeros(len(tract_geoms))
+
+    tree = shapely.STRtree(parts)
+    tract_idx, part_idx = tree.query(tract_geoms, predicate='intersects')
+
+    areas = shapely.area(shapely.intersection(tract_geoms[tract_idx], parts[part_idx]))
+    covered = np.bincount(tract_idx, weights=areas, minlength=len(tract_geoms))
+
+    return np.clip(covered/shapely.area(tract_geoms), 0, 1)
+
+
+def reachable_counts(tract_geoms, isochrone_geoms, point_ids):
+    '''
+        Returns the number of distinct points whose isochrones intersect each tract.
+        '''
+    tree = shapely.STRtree(isochrone_geoms)
+    tract_idx, iso_idx = tree.query(tract_geoms, predicate='intersects')
+
+    pairs = pd.DataFrame({'tract': tract_idx, 'point': np.asarray(point_ids)[iso_idx]})
+    counts = pairs.drop_duplicates().groupby('tract').size()
+
+    return counts.reindex(range(len(tract_geoms)), fill_value=0).to_numpy()
+
+
+def compute_access_metrics(tracts, isochrones, unions=None):
+    '''
+        Computes food access measures for each tract.
+
+        For each of the 5, 7 and 10-minute walking ranges, returns the share
+        of the tract's area within walking range of a market, the population
+        within range (assuming population is spread evenly over the tract),
+        and the number of markets whose isochrone reaches the tract.
+
+        Parameters
+        ----------
+        tracts: GeoDataFrame
+            Tracts with "GEOID" and total population ("B01003_001E") columns.
+
+        isochrones: GeoDataFrame
+            Isochrones with "id" and "value" (travel time in seconds) columns.
+
+        unions: GeoDataFrame
+            Isochrone unions as returned by load_or_build_unions; loaded or
+            built if not provided.
+
+
+        Returns
+        -------
+        DataFrame
+            One row per tract, with columns GEOID, share_<range>,
+            pop_<range> and markets_<range> for each range.
+        '''
+    if unions is None:
+        unions = load_or_build_unions(isochrones)
+
+    tract_geoms = tracts.geometry.to_crs(PROJECTED_CRS).to_numpy()
+    iso_projected = isochrones.to_crs(PROJECTED_CRS)
+    union_layers = as_layers(unions.to_crs(PROJECTED_CRS), 'union')
+    population = pd.to_numeric(tracts['B01003_001E'], errors='coerce').to_numpy()
+
+    metrics = pd.DataFrame({'GEOID': tracts['GEOID'].to_numpy()})
+    for layer, seconds in RANGES.items():
+        shares = coverage_shares(tract_geoms, union_layers[layer])
+        in_range = iso_projected[iso_projected['value'] == seconds]
+
+        metrics[f'share_{layer}'] = shares.round(4)
+        metrics[f'pop_{layer}'] = (shares*population).round()
+        metrics[f'markets_{layer}'] = reachable_counts(tract_geoms, in_range.geometry.to_numpy(),
+                                                       in_range['id'].to_numpy())
+
+    return metrics
+
+
+def make_access_table(tracts, isochrones, unions=None):
+    '''
+        Computes tract food access measures and writes them to the
+        "tract_access" table of the map database.
+
+        Returns the measures as a DataFrame.
+        '''
+    metrics = compute_access_metrics(tracts, isochrones, unions)
+    map_db.bulk_load('tract_access', metrics, primary_key='GEOID')
+
+    return metrics
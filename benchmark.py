@@ -0,0 +1,406 @@
+#Imports
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import geopandas as gpd
+import shapely
+
+from transport import FixtureResponse, ReplayTransport
+
+
+BENCHMARK_DIR = os.path.abspath('Benchmarks')
+
+#Synthetic data sizes and extents (min_lon, min_lat, max_lon, max_lat)
+SCALES = {'nyc': {'markets': 1000, 'tracts': 2200, 'bounds': (-74.26, 40.49, -73.70, 40.92)},
+          'state': {'markets': 6000, 'tracts': 5400, 'bounds': (-79.76, 40.49, -71.85, 45.02)},
+          'us': {'markets': 40000, 'tracts': 85000, 'bounds': (-124.8, 24.5, -66.9, 49.4)}}
+
+#get_acs_data requests tracts in these New York City counties
+COUNTIES = ['081', '061', '085', '005', '047']
+
+SHOPS = ['supermarket', 'grocery', 'greengrocer']
+WALKING_SPEED = 5/3.6
+
+STAGES = ['markets', 'isochrones', 'tracts', 'access', 'nearest',
+          'isochrone_layers', 'tract_map', 'market_map']
+
+
+def make_tracts(n, bounds, seed=0):
+    '''
+        Returns n square tracts tiling bounds, with the attributes of the
+        TIGER tract layer and GEOIDs spread over the counties in COUNTIES.
+        '''
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = bounds
+
+    cols = max(1, int(round(math.sqrt(n * (max_lon - min_lon) / (max_lat - min_lat)))))
+    rows = math.ceil(n / cols)
+    width, height = (max_lon - min_lon) / cols, (max_lat - min_lat) / rows
+
+    i = np.arange(n)
+    x0, y0 = min_lon + (i % cols)*width, min_lat + (i // cols)*height
+    boxes = shapely.box(x0, y0, x0 + width, y0 + height)
+    #Real tract outlines have dozens of vertices
+    geometries = shapely.segmentize(boxes, max(width, height) / 10)
+
+    counties = np.array(COUNTIES)[i % len(COUNTIES)]
+    tract_codes = np.char.zfill((i // len(COUNTIES) + 100).astype(str), 6)
+
+    return gpd.GeoDataFrame({'STATEFP': '36',
+                             'COUNTYFP': counties,
+                             'TRACTCE': tract_codes,
+                             'GEOID': np.char.add(np.char.add('36', counties), tract_codes),
+                             'NAME': tract_codes,
+                             'NAMELSAD': np.char.add('Census Tract ', tract_codes),
+                             'MTFCC': 'G5020',
+                             'FUNCSTAT': 'S',
+                             'ALAND': rng.integers(100000, 5000000, n),
+                             'AWATER': 0,
+                             'INTPTLAT': [f'{lat:+.7f}' for lat in y0 + height/2],
+                             'INTPTLON': [f'{lon:+012.7f}' for lon in x0 + width/2]},
+                            geometry=geometries, crs='epsg:4326')
+
+
+def make_overpass_response(n, bounds, seed=0):
+    '''
+        Returns an Overpass JSON response holding n market nodes within bounds.
+        '''
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = bounds
+    lons = rng.uniform(min_lon, max_lon, n).round(7)
+    lats = rng.uniform(min_lat, max_lat, n).round(7)
+
+    elements = []
+    for i in range(n):
+        tags = {'name': f'Market {i}', 'shop': SHOPS[i % len(SHOPS)]}
+        if i % 3:
+            tags.update({'addr:housenumber': str(i), 'addr:street': 'Main Street', 'addr:city': 'New York'})
+        elements.append({'type': 'node', 'id': 1000000 + i, 'lat': lats[i], 'lon': lons[i], 'tags': tags})
+
+    return {'version': 0.6, 'generator': 'benchmark', 'elements': elements}
+
+
+def make_isochrone_response(payload, vertices=48):
+    '''
+        Returns an ORS-shaped isochrones response of circles, sized by
+        walking speed, around each location in an ORS request payload.
+        '''
+    angles = np.linspace(0, 2*math.pi, vertices, endpoint=False)
+    features = []
+    for group_index, (lon, lat) in enumerate(payload['locations']):
+        for value in payload['range']:
+            metres = value*WALKING_SPEED*0.8
+            ring = np.column_stack([lon + np.cos(angles)*metres/(111320*math.cos(math.radians(lat))),
+                                    lat + np.sin(angles)*metres/111320]).round(6).tolist()
+            ring.append(ring[0])
+            area = math.pi*metres**2
+            features.append({'type': 'Feature',
+                             'properties': {'group_index': group_index, 'value': float(value),
+                                            'center': [lon, lat], 'area': round(area, 4),
+                                            'reachfactor': 0.64, 'total_pop': float(int(area/100))},
+                             'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def make_census_response(tracts, params, seed=0):
+    '''
+        Returns a Census API response for the variables and county requested.
+        '''
+    county = params['in'][1].split(':')[1]
+    variables = params['get'].split(',')
+    county_tracts = tracts[tracts['COUNTYFP'] == county]['TRACTCE'].to_numpy()
+
+    rng = np.random.default_rng([seed, int(county)])
+    values = rng.integers(0, 5000, (len(county_tracts), len(variables)))
+    #A few Census annotations (negative values), as in real responses
+    values[rng.random(values.shape) < 0.01] = -666666666
+
+    rows = [variables + ['state', 'county', 'tract']]
+    rows += [[str(value) for value in row] + ['36', county, tract]
+             for row, tract in zip(values.tolist(), county_tracts)]
+
+    return rows
+
+
+class SyntheticAPI:
+    '''
+        A transport answering Overpass, OpenRouteService and Census requests
+        with synthetic data, used to record benchmark fixtures.
+        '''
+
+    def __init__(self, tracts, overpass_response, seed=0):
+        self.tracts = tracts
+        self.overpass_response = overpass_response
+        self.seed = seed
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=None):
+        return self.respond(url, params, json)
+
+    def respond(self, url, params, payload):
+        if 'overpass' in url:
+            body = self.overpass_response
+        elif 'openrouteservice' in url:
+            body = make_isochrone_response(payload)
+        elif 'census' in url:
+            body = make_census_response(self.tracts, params, self.seed)
+        else:
+            raise ValueError(f'No synthetic data for {url}')
+
+        return FixtureResponse(url, 200, {'Content-Type': 'application/json'}, json.dumps(body))
+
+    def close(self):
+        pass
+
+
+def file_sizes(directories):
+    sizes = {}
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                sizes[path] = (stat.st_size, stat.st_mtime_ns)
+
+    return sizes
+
+
+def _measure(func, conn):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+
+    #ru_maxrss is in kilobytes on Linux; worker processes count as children
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    conn.send((seconds, peak / 1024))
+    conn.close()
+
+
+def measure(func):
+    '''
+        Runs func in a forked process and returns its wall time in seconds,
+        the peak resident memory of the process (and any it started) in MB,
+        and the sizes of the files it wrote.
+        '''
+    before = file_sizes(['Geospatial_Data', 'static', 'Cache'])
+
+    receiver, sender = multiprocessing.get_context('fork').Pipe(duplex=False)
+    process = multiprocessing.get_context('fork').Process(target=_measure, args=(func, sender))
+    process.start()
+    sender.close()
+    try:
+        seconds, peak_rss = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f'Benchmark stage failed with exit code {process.exitcode}')
+    process.join()
+
+    after = file_sizes(['Geospatial_Data', 'static', 'Cache'])
+    outputs = {path: size for path, (size, mtime) in after.items() if before.get(path) != (size, mtime)}
+
+    return {'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss, 1),
+            'output_bytes': sum(outputs.values()), 'outputs': outputs}
+
+
+def prepare(workdir, scale, seed=0):
+    '''
+        Writes the synthetic tract layers for a scale into workdir and
+        returns a SyntheticAPI for its API responses.
+        '''
+    settings = SCALES[scale]
+    os.makedirs(os.path.join(workdir, 'Geospatial_Data'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'static'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'Cache'), exist_ok=True)
+
+    tracts = make_tracts(settings['tracts'], settings['bounds'], seed)
+    for layer in ['NYC_Tracts', 'NYC_Tracts_Clipped']:
+        path = os.path.join(workdir, 'Geospatial_Data', f'{layer}.geojson')
+        if not os.path.exists(path):
+            tracts.to_file(path, driver='GeoJSON')
+
+    return SyntheticAPI(tracts, make_overpass_response(settings['markets'], settings['bounds'], seed), seed)
+
+
+def run_benchmarks(scale='nyc', stages=STAGES, seed=0, workdir=None):
+    '''
+        Runs the pipeline and map-building functions on synthetic data,
+        replaying recorded API responses, and measures each stage.
+
+        Fixtures are recorded on the first run at a scale and seed, in an
+        untimed pass, and replayed by later runs. Each stage runs in a forked
+        process, against a freshly cleared API cache.
+
+        Parameters
+        ----------
+        scale: str
+            One of the keys of SCALES.
+
+        stages: list
+            The stages to be measured, from STAGES; later stages need the
+            outputs of earlier ones to exist in workdir.
+
+        seed: int
+            The seed of the synthetic data.
+
+        workdir: str
+            The directory in which data are written; defaults to
+            Benchmarks/work/<scale>.
+
+
+        Returns
+        -------
+        dict
+            The measurements of each stage, with details of the run.
+        '''
+    workdir = os.path.abspath(workdir or os.path.join(BENCHMARK_DIR, 'work', scale))
+    os.makedirs(workdir, exist_ok=True)
+    fixture_dir = os.path.join(workdir, 'fixtures')
+
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(workdir)
+
+    import get_data
+    from access_metrics import make_access_table
+    from build_maps import make_isochrone_layers, make_market_map, make_tract_map
+    from layer_store import ACS_COLUMNS, load_layer
+    from nearest_markets import MarketIndex, make_nearest_table
+
+    synthetic = prepare(workdir, scale, seed)
+
+    #Fixtures are keyed without API keys, so any will do
+    os.environ.setdefault(get_data.CENSUS_KEY_NAME, 'benchmark')
+    os.environ.setdefault(get_data.ORS_KEY_NAME, 'benchmark')
+
+    #Replay at full speed, with the ORS rate limit lifted
+    get_data.ORS_REQUESTS_PER_MINUTE = 1e6
+    get_data.STREET_GRAPH_PATH = None
+
+    def open_cache(*cleared):
+        get_data.CACHE_VAR = get_data.open_cache(get_data.CACHE_PATH)
+        for cache_name in cleared:
+            get_data.CACHE_VAR.clear(cache_name)
+
+    def load_tracts():
+        tracts = load_layer('Tracts_with_Data', columns=['GEOID'] + ACS_COLUMNS + ['pct_nonwhite'])
+        tracts[ACS_COLUMNS] = tracts[ACS_COLUMNS].astype(float)
+        tracts['pct_nonwhite'] = tracts['pct_nonwhite']*100
+        return tracts
+
+    def markets_stage():
+        open_cache()
+        get_data.get_market_data(refresh=True)
+
+    def isochrones_stage():
+        open_cache('markets_isochrones', 'markets_snapshot')
+        get_data.refresh_isochrones(load_layer('markets'), 'markets')
+
+    def tracts_stage():
+        open_cache('census')
+        get_data.get_acs_data()
+
+    stage_functions = {
+        'markets': markets_stage,
+        'isochrones': isochrones_stage,
+        'tracts': tracts_stage,
+        'access': lambda: make_access_table(load_layer('Tracts_with_Data'), load_layer('isochrones')),
+        'nearest': lambda: make_nearest_table(load_layer('Tracts_with_Data'),
+                                              MarketIndex.from_frame(load_layer('markets'))),
+        'isochrone_layers': lambda: make_isochrone_layers(load_layer('isochrones', columns=['value'])),
+        'tract_map': lambda: make_tract_map(load_layer('markets', columns=['name']),
+                                            load_tracts()).save('static/tracts.html'),
+        'market_map': lambda: make_market_map(load_layer('markets', columns=['name']),
+                                              make_isochrone_layers(load_layer('isochrones', columns=['value'])))
+                              .save('static/markets.html')}
+
+    marker = os.path.join(fixture_dir, 'complete')
+    if not os.path.exists(marker):
+        print(f"Recording synthetic API responses for scale '{scale}'...")
+        get_data.TRANSPORT = ReplayTransport(fixture_dir, record=synthetic)
+        for name in ['markets', 'isochrones', 'tracts']:
+            measure(stage_functions[name])
+        open(marker, 'w').close()
+
+    get_data.TRANSPORT = ReplayTransport(fixture_dir)
+
+    results = {}
+    for name in stages:
+        print(f"Measuring {name}...")
+        results[name] = measure(stage_functions[name])
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=code_dir,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {'scale': scale, 'seed': seed, 'commit': commit,
+            'markets': SCALES[scale]['markets'], 'tracts': SCALES[scale]['tracts'],
+            'python': platform.python_version(), 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'stages': results}
+
+
+def print_report(report, baseline=None, tolerance=0.1):
+    '''
+        Prints a table of stage measurements, compared with a baseline if
+        given. Returns the names of stages more than `tolerance` slower than
+        in the baseline.
+        '''
+    print(f"\nScale: {report['scale']} ({report['markets']} markets, {report['tracts']} tracts), "
+          f"commit {report['commit']}")
+    print(f"{'stage':<18}{'seconds':>10}{'peak MB':>10}{'output MB':>11}{'vs. baseline':>14}")
+
+    regressions = []
+    for name, stage in report['stages'].items():
+        comparison = ''
+        if baseline is not None and name in baseline['stages']:
+            previous = baseline['stages'][name]['seconds']
+            ratio = stage['seconds'] / previous if previous > 0 else 1
+            comparison = f'{ratio:.2f}x'
+            if ratio > 1 + tolerance:
+                comparison += ' SLOWER'
+                regressions.append(name)
+
+        print(f"{name:<18}{stage['seconds']:>10.2f}{stage['peak_rss_mb']:>10.0f}"
+              f"{stage['output_bytes']/1e6:>11.2f}{comparison:>14}")
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline and map builders on synthetic data.')
+    parser.add_argument('--scale', choices=list(SCALES), default='nyc')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='NAME', help='save the results as baseline NAME')
+    parser.add_argument('--compare', metavar='NAME', help='compare the results with baseline NAME')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='the slowdown, as a fraction, reported as a regression')
+    args = parser.parse_args()
+
+    baseline_path = lambda name: os.path.join(BENCHMARK_DIR, 'baselines', f'{name}_{args.scale}.json')
+
+    baseline = None
+    if args.compare:
+        with open(baseline_path(args.compare), 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    report = run_benchmarks(args.scale, args.stages, seed=args.seed)
+    regressions = print_report(report, baseline, args.tolerance)
+
+    if args.save:
+        os.makedirs(os.path.dirname(baseline_path(args.save)), exist_ok=True)
+        with open(baseline_path(args.save), 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Saved baseline to {baseline_path(args.save)}")
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,181 @@
+#Imports
+import folium
+import folium.plugins
+import geopandas as gpd
+
+from instrumentation import RECORDER, measure, profile_path, record_written, timed
+from isochrone_unions import RANGES, load_or_build_unions
+from layer_store import ACS_COLUMNS, load_layer
+from map_layers import IndicatorChoropleth, MarketMarkers, marker_rows
+from simplify_layers import simplified_layer
+
+
+BASEMAP = 'cartodbpositron'
+
+TRACT_INDICATORS = [{'column': 'B19049_001E', 'name': 'Median Income',
+                     'fill_color': 'Greens', 'legend_name': 'Median Income ($)'},
+                    {'column': 'pct_nonwhite', 'name': 'Pct. Population Nonwhite',
+                     'fill_color': 'Blues', 'legend_name': 'Pct. Nonwhite'},
+                    {'column': 'B01002_001E', 'name': 'Median Age',
+                     'fill_color': 'Oranges', 'legend_name': 'Median Age'}]
+
+
+def make_isochrone_layers(isochrone_data, kind='union', detail='medium'):
+    '''
+        Returns the 5, 7 and 10-minute isochrone layers, reusing the unions
+        precomputed by get_data.py unless the isochrones have since changed.
+
+        Parameters
+        ----------
+        isochrone_data: GeoDataFrame
+            Isochrones with a "value" column giving travel time in seconds.
+
+        kind: str
+            'union' for overlapping unions, or 'band' for mutually exclusive
+            bands.
+
+        detail: str
+            The level of geometric detail: 'low', 'medium' or 'high'.
+
+
+        Returns
+        -------
+        dict
+            Single-row GeoDataFrames keyed by '5min', '7min' and '10min'.
+        '''
+    with timed('maps.unions'):
+        unions = load_or_build_unions(isochrone_data)
+    selected = unions[unions['kind'] == kind]
+
+    #Bands do not overlap, so they are simplified without opening gaps between them
+    path = simplified_layer(selected, f'isochrone_{kind}s', detail, columns=['layer'],
+                            coverage=(kind == 'band'))
+    layers = gpd.read_file(path)
+
+    return {layer: layers[layers['layer'] == layer] for layer in RANGES}
+
+def make_market_map(market_data, isochrone_data, market_rows=None):
+
+    m = folium.Map(location=[40.728783, -73.992320],
+                  tiles = BASEMAP,
+                  zoom_start=11)
+
+    #Creating Clusters of Market Locations
+    if market_rows is None:
+        market_rows = marker_rows(market_data)
+    m.add_child(MarketMarkers(market_rows, name='Markets'))
+
+    isochron_layers = folium.map.FeatureGroup(name='Walking Time')
+    m.add_child(isochron_layers)
+
+    _10min = folium.plugins.FeatureGroupSubGroup(isochron_layers, '10 min.')
+    m.add_child(_10min)
+
+    _7min = folium.plugins.FeatureGroupSubGroup(isochron_layers, '7 min.')
+    m.add_child(_7min)
+
+    _5min = folium.plugins.FeatureGroupSubGroup(isochron_layers, '5 min.')
+    m.add_child(_5min)
+
+
+    _10min.add_child(folium.GeoJson(isochrone_data['10min'], name='10 min.', style_function = lambda x:
+                                    {'fillColor': '#FE9B5B',
+                                     'fillOpacity': 0.5,
+                                     'weight': 1,
+                                     'color': 'black'
+                                    }))
+    _7min.add_child(folium.GeoJson(isochrone_data['7min'], name='7 min.', style_function = lambda x:
+                                    {'fillColor': '#FEEB7D',
+                                     'fillOpacity': 0.5,
+                                     'weight': 1,
+                                     'color': 'black'
+                                    }))
+    _5min.add_child(folium.GeoJson(isochrone_data['5min'], name='5 min.', style_function = lambda x:
+                                    {'fillColor': '#CFFF91',
+                                     'fillOpacity': 0.5,
+                                     'weight': 1,
+                                     'color': 'black'
+                                    }))
+
+    folium.LayerControl(autoZIndex=True, hideSingleBase="true").add_to(m)
+
+    return m
+
+
+def make_tract_map(market_data, tract_data, detail='medium', shared_geometry=True, market_rows=None):
+    '''
+        Builds the map of tract indicators and market locations.
+
+        If shared_geometry is True, tract geometry is embedded once and the
+        indicators in TRACT_INDICATORS are switched in the browser; otherwise
+        each indicator is drawn as a separate folium Choropleth. Market
+        markers are drawn from market_rows (see map_layers.marker_rows) if given.
+        '''
+    tract_shapes = load_layer('NYC_Tracts_Clipped', columns=['GEOID'])
+    tract_geo_data = simplified_layer(tract_shapes, 'tracts', detail, columns=['GEOID'], coverage=True)
+
+    m = folium.Map(location=[40.728783, -73.992320], tiles = BASEMAP, zoom_start=11)
+
+    #Creating Clusters of Market Locations
+    if market_rows is None:
+        market_rows = marker_rows(market_data)
+    m.add_child(MarketMarkers(market_rows, name='Markets'))
+
+
+    if shared_geometry:
+        IndicatorChoropleth(tract_geo_data, tract_data, TRACT_INDICATORS,
+                            name='Census Tracts').add_to(m)
+    else:
+        for i, indicator in enumerate(TRACT_INDICATORS):
+            folium.features.Choropleth(name=indicator['name'],
+                                       geo_data=tract_geo_data,
+                                       data=tract_data, columns=['GEOID', indicator['column']],
+                                       key_on='feature.properties.GEOID',
+                                       fill_color=indicator['fill_color'], show=(i == 0),
+                                       legend_name=indicator['legend_name']).add_to(m)
+
+
+    folium.LayerControl(autoZIndex=True, hideSingleBase="true").add_to(m)
+
+    return m
+
+
+def build_maps(detail='medium', profile=()):
+    '''
+        Builds the tract and market maps from the layers saved by get_data.py,
+        saving them to static/tracts.html and static/markets.html.
+
+        The isochrone layers and each map are built as stages whose time and
+        peak memory are recorded in instrumentation.RECORDER; stages named in
+        profile ('isochrone_layers', 'tract_map', 'market_map') are run under
+        cProfile.
+        '''
+    def stage(name, func, *args):
+        path = profile_path(name) if name in profile else None
+        result, measurements = measure(func, *args, profile_path=path)
+        RECORDER.set_stage(name, dict(measurements, status='ran'))
+        print(f"Stage {name} ran in {measurements['seconds']:.1f} seconds")
+        return result
+
+    def save(m, path):
+        with timed('maps.save'):
+            m.save(path)
+        record_written(path)
+
+    markets = load_layer('markets', columns=['name'])
+
+    isochrones = load_layer('isochrones', columns=['value'])
+    isochrone_data = stage('isochrone_layers', lambda: make_isochrone_layers(isochrones, detail=detail))
+
+    tracts = load_layer('Tracts_with_Data', columns=['GEOID'] + ACS_COLUMNS + ['pct_nonwhite'])
+    #Tract layers written before ACS values were stored as numbers hold strings
+    tracts[ACS_COLUMNS] = tracts[ACS_COLUMNS].astype(float)
+    tracts['pct_nonwhite'] = tracts['pct_nonwhite']*100
+
+    #Both maps draw their markers from the same rows
+    market_rows = marker_rows(markets)
+
+    stage('tract_map', lambda: save(make_tract_map(markets, tracts, detail=detail, market_rows=market_rows),
+                                    'static/tracts.html'))
+    stage('market_map', lambda: save(make_market_map(markets, isochrone_data, market_rows=market_rows),
+                                     'static/markets.html'))
@@ -0,0 +1,188 @@
+#Imports
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+
+class CacheStore:
+    '''
+        Key/value store for API responses, backed by a single SQLite file.
+
+        Entries are grouped by cache name (e.g. 'markets', 'census') and are
+        written individually, so saving a response never rewrites the rest of
+        the cache, and lookups never load more than the requested entry.
+
+        Parameters
+        ----------
+        cache_path: str
+            The path to the SQLite file holding the cache; created if absent.
+        '''
+
+    def __init__(self, cache_path):
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir != '':
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.path = cache_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS "cache"(
+        "cache_name" TEXT NOT NULL,
+        "key" TEXT NOT NULL,
+        "value" TEXT NOT NULL,
+        PRIMARY KEY ("cache_name", "key"))''')
+        self.conn.commit()
+
+    def get(self, cache_name, key, default=None):
+        '''
+            Returns the entry stored under a key, or default if there is none.
+            '''
+        with self.lock:
+            row = self.conn.execute('''SELECT "value" FROM "cache"
+            WHERE "cache_name" = ? AND "key" = ?''', (cache_name, key)).fetchone()
+
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def put(self, cache_name, key, value):
+        '''
+            Writes a single entry, replacing any entry stored under the same key.
+            '''
+        self.put_many(cache_name, {key: value})
+
+    def put_many(self, cache_name, entries):
+        '''
+            Writes several entries in a single transaction.
+
+            Parameters
+            ----------
+            cache_name: str
+                The name of the cache the entries belong to.
+
+            entries: dict
+                A dictionary of keys and JSON-serializable values.
+
+
+            Returns
+            -------
+            None
+            '''
+        rows = [(cache_name, str(key), json.dumps(value)) for key, value in entries.items()]
+
+        with self.lock, self.conn:
+            self.conn.executemany('''INSERT OR REPLACE INTO "cache"
+            VALUES (?, ?, ?)''', rows)
+
+    def delete(self, cache_name, keys):
+        '''
+            Removes the entries stored under the keys provided.
+            '''
+        rows = [(cache_name, str(key)) for key in keys]
+
+        with self.lock, self.conn:
+            self.conn.executemany('''DELETE FROM "cache"
+            WHERE "cache_name" = ? AND "key" = ?''', rows)
+
+    def clear(self, cache_name):
+        '''
+            Removes every entry belonging to a cache name.
+            '''
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM "cache" WHERE "cache_name" = ?', (cache_name,))
+
+    def keys(self, cache_name):
+        '''
+            Returns the set of keys stored under a cache name.
+            '''
+        with self.lock:
+            rows = self.conn.execute('SELECT "key" FROM "cache" WHERE "cache_name" = ?',
+                                     (cache_name,)).fetchall()
+        return {row[0] for row in rows}
+
+    def values(self, cache_name):
+        '''
+            Yields the entries stored under a cache name, one at a time.
+            '''
+        with self.lock:
+            rows = self.conn.execute('''SELECT "value" FROM "cache"
+            WHERE "cache_name" = ? ORDER BY rowid''', (cache_name,)).fetchall()
+
+        for row in rows:
+            yield json.loads(row[0])
+
+    def items(self, cache_name):
+        '''
+            Yields the keys and entries stored under a cache name, one at a time.
+            '''
+        with self.lock:
+            rows = self.conn.execute('''SELECT "key", "value" FROM "cache"
+            WHERE "cache_name" = ? ORDER BY rowid''', (cache_name,)).fetchall()
+
+        for row in rows:
+            yield row[0], json.loads(row[1])
+
+    def compact(self):
+        '''
+            Reclaims the space left behind by replaced and deleted entries.
+            '''
+        with self.lock:
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self.conn.execute('VACUUM')
+
+    def import_json(self, json_path):
+        '''
+            Imports a cache file written by earlier versions of get_data.py,
+            which held every cache name in one JSON dictionary.
+
+            Isochrone layers, formerly stored as a single index and
+            FeatureCollection, are split into one entry per market id.
+
+            Parameters
+            ----------
+            json_path: str
+                The path to the legacy JSON cache.
+
+
+            Returns
+            -------
+            int
+                The number of entries imported.
+            '''
+        with open(json_path, 'r') as cache_file:
+            legacy_cache = json.load(cache_file)
+
+        count = 0
+        for cache_name, entries in legacy_cache.items():
+            if 'GeoJSON' in entries and 'index' in entries:
+                features_by_id = {}
+                for feature in entries['GeoJSON']['features']:
+                    features_by_id.setdefault(str(feature['properties']['id']), []).append(feature)
+                entries = features_by_id
+
+            self.put_many(cache_name, entries)
+            count += len(entries)
+
+        return count
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    #Usage: python cache_store.py compact|import [cache_path] [json_path]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'compact'
+    store = CacheStore(sys.argv[2] if len(sys.argv) > 2 else './Cache/Cache.sqlite')
+
+    if command == 'import':
+        json_path = sys.argv[3] if len(sys.argv) > 3 else './Cache/Cache.json'
+        print(f"Imported {store.import_json(json_path)} entries from {json_path}")
+    else:
+        store.compact()
+        print(f"Compacted {store.path}")
+
+    store.close()
@@ -1,28 +1,64 @@
 #Imports
-import secrets
-
 import pandas as pd
 import geopandas as gpd
 import numpy as np
+import shapely
 
-import requests
+import importlib
 import json
-import time
-import sqlite3
-import math
+import os
+import threading
+from functools import partial
+
+import map_db
+from access_metrics import make_access_table
+from cache_store import CacheStore
+from instrumentation import RECORDER, count, record_written, timed
+from isochrone_unions import UNIONS_PATH, load_or_build_unions
+from layer_store import load_layer
+from local_isochrones import LocalIsochroneEngine, StreetGraph
+from nearest_markets import MarketIndex, make_nearest_table
+from ors_scheduler import IsochroneScheduler
+from overpass_parser import parse_points
+from pipeline import Pipeline, Stage
+from tract_index import TractIndex
+from transport import make_transport
 
 
 #Global Vars
-CENSUS_KEY = secrets.CENSUS_API_KEY
-
+#API keys are read, when first needed, from environment variables of these
+#names or else from the module named by KEYS_MODULE
+CENSUS_KEY_NAME = 'CENSUS_API_KEY'
+ORS_KEY_NAME = 'ORS_API_KEY'
+KEYS_MODULE = 'api_keys'
 
-ORS_KEY = secrets.ORS_API_KEY
 ORS_URL = 'https://api.openrouteservice.org/v2/isochrones/foot-walking'
+ORS_REQUESTS_PER_MINUTE = 20
+ORS_MAX_IN_FLIGHT = 4
+
+#Set FOOD_ACCESS_STREET_GRAPH to a street network (GeoJSON edges or an OSM extract)
+#to compute isochrones locally instead of through OpenRouteService
+STREET_GRAPH_PATH = os.environ.get('FOOD_ACCESS_STREET_GRAPH')
 
-CACHE_PATH = './Cache/Cache.json'
-CACHE_VAR = {}
+CACHE_PATH = './Cache/Cache.sqlite'
+LEGACY_CACHE_PATH = './Cache/Cache.json'
+CACHE_VAR = None
+
+#Built on first use (see get_transport); set FOOD_ACCESS_FIXTURES to a directory
+#to replay API responses offline
+TRANSPORT = None
+TRANSPORT_LOCK = threading.Lock()
+
+TRACT_INDEX = None
 
 overpass_url = "http://overpass-api.de/api/interpreter?"
+OVERPASS_CACHE_PATH = './Cache/overpass_markets.json'
+
+#Raise when the markets layer or table gains columns or indexes, so that
+#databases written by earlier versions are rebuilt (2: lon/lat and markets_rtree)
+MARKETS_SCHEMA_VERSION = 2
+MARKET_TAGS = ['name', 'alt_name', 'shop', 'opening_hours', 'phone',
+               'addr:housenumber', 'addr:street', 'addr:city']
 overpass_query_markets = '''[out:json]
 [timeout:25]
 ;
@@ -61,57 +97,58 @@ out center;
 out skel qt;
 '''
 
-def open_cache(cache_path):
+def open_cache(cache_path, legacy_path=LEGACY_CACHE_PATH):
     '''
-        Opens the cache with the file path provided as a dictionary; if no cache is present,
-        creates a cache dictionary.
+        Opens the cache store with the file path provided; if no cache is present,
+        creates one, importing any entries held in a legacy JSON cache.
 
-        Returns the resultant cache dictionary.
+        Returns the resultant cache store.
 
         Parameters
         ----------
         cache_path: str
             The path to a cache file, if such a file exists.
 
+        legacy_path: str
+            The path to a JSON cache written by earlier versions of this module.
+
         Returns
         -------
-        dict
-            A dictionary containing cached information stored in the form of a json.
+        CacheStore
+            A store containing cached information, keyed by cache name and key.
         '''
-    try:
-        with open(cache_path, 'r') as cache_file:
-                cache = json.load(cache_file)
-    except:
-        cache = {}
+    new_cache = not os.path.exists(cache_path)
+    cache = CacheStore(cache_path)
+
+    if new_cache and legacy_path is not None and os.path.exists(legacy_path):
+        print(f"Importing legacy cache: {legacy_path}")
+        cache.import_json(legacy_path)
 
     return cache
 
 
-def save_cache(cache_data, cache_name):
+def save_cache(cache_data, cache_name, key):
     '''
-        Saves a cache dictionary to the filepath provided.
+        Saves a single cache entry to the open cache store.
 
         Parameters
         ----------
-        cache_name: dict
-            A dictionary containing cached webpage information.
+        cache_data: dict
+            The information to be cached.
 
-        cache_path: str
-            The file path where the cache is to be saved.
+        cache_name: str
+            The name of the cache the entry belongs to.
+
+        key: str
+            The key under which the entry is stored.
 
 
         Returns
         -------
         None
         '''
-    if cache_name is not None and CACHE_VAR is not None:
-        updated_cache = CACHE_VAR.copy()
-        updated_cache[cache_name] = cache_data
-    else:
-        updated_cache = cache_data
-
-    with open(CACHE_PATH, 'w') as cache_file:
-        json.dump(updated_cache, cache_file, indent=2)
+    with timed('cache.write'):
+        CACHE_VAR.put(cache_name, key, cache_data)
 
 
 def construct_unique_key(params, api_url):
@@ -153,8 +190,11 @@ def call_API_with_cache(url, params, cache_name, reset_cache=False):
         params: dict
             A dictionary containing search parameters; defaults to None.
 
-        cache: dict
-            A dictionary containing previously obtained data.
+        cache_name: str
+            The name of the cache in which responses are stored.
+
+        reset_cache: bool
+            If True, ignores any cached response and fetches afresh.
 
 
         Returns
@@ -163,153 +203,338 @@ def call_API_with_cache(url, params, cache_name, reset_cache=False):
             The JSON returned by the API call, formatted as a dictionary.
         '''
 
-    if reset_cache == False:
-        temp_cache = CACHE_VAR.setdefault(cache_name, {})
-    else:
-        temp_cache = {}
-
     if params is not None:
         key = construct_unique_key(params, url)
     else:
         key = url
 
-    if key in temp_cache.keys():
+    if reset_cache == False:
+        content = CACHE_VAR.get(cache_name, key)
+    else:
+        content = None
+
+    if content is not None:
         print(f"Using Cache: {url}")
-        content = temp_cache[key]
+        count(f'cache.{cache_name}.hits')
         return content
     else:
         print(f"Fetching: {url}")
-        if params is not None:
-            content = requests.get(url=url, params=params).json()
-        else:
-            content = requests.get(url=url).json()
+        count(f'cache.{cache_name}.misses')
+        with timed(f'http.{cache_name}'):
+            content = get_transport().get(url, params=params).json()
 
-        temp_cache[key] = content
-        save_cache(temp_cache, cache_name)
+        save_cache(content, cache_name, key)
 
     return content
 
 
 
-def get_market_data(refresh=False):
-    '''TODO: Docstring
+def save_layer(geodataframe, layer_name):
+    '''
+        Saves a layer to Geospatial_Data as GeoParquet, the format read by
+        RUN_ME.py, and as GeoJSON for export.
 
-    Fetches market data, saves and returns as GeoJSON'''
+        Parameters
+        ----------
+        geodataframe: GeoDataFrame
+            The layer to be saved.
 
-    geographic_elements = {'type':'FeatureCollection',
-                      'name':'markets',
-                      'features':[]}
+        layer_name: str
+            The file name of the layer, without extension.
 
 
-    results = call_API_with_cache(url=overpass_url,
-                                  params={'data':overpass_query_markets},
-                                  cache_name='markets', reset_cache=refresh)
+        Returns
+        -------
+        None
+        '''
+    #Written last, so RUN_ME.py finds it at least as new as the GeoJSON
+    with timed(f'save_layer.{layer_name}'):
+        geodataframe.to_file(f'Geospatial_Data/{layer_name}.geojson', driver='GeoJSON')
+        geodataframe.to_parquet(f'Geospatial_Data/{layer_name}.parquet', index=False,
+                                write_covering_bbox=True)
 
-    for element in results['elements']:
-        if 'tags' in element:
-            geodict = {'type':'Point'}
-            propdict = {'id':element['id']}
+    record_written(f'Geospatial_Data/{layer_name}.geojson', f'Geospatial_Data/{layer_name}.parquet')
 
-            if element['type'] == 'node' and 'tags' in element:
-                lon = element['lon']
-                lat = element['lat']
-                geodict['coordinates'] = [lon, lat]
 
-            elif 'center' in element:
-                lon = element['center']['lon']
-                lat = element['center']['lat']
-                geodict['coordinates'] = [lon, lat]
+def get_tract_index():
+    '''
+        Returns the tract index used to assign markets to census tracts,
+        loading it on first use.
+        '''
+    global TRACT_INDEX
+    if TRACT_INDEX is None:
+        TRACT_INDEX = TractIndex.from_file('Geospatial_Data/NYC_Tracts.geojson')
+    return TRACT_INDEX
 
-            for key, value in element['tags'].items():
-                propdict[key] = value
 
-            geographic_elements['features'].append({'type':'Feature',
-                                       'geometry':geodict,
-                                       'properties':propdict})
+def api_key(name):
+    '''
+        Returns the API key held in the environment variable `name` or, if it
+        is unset, the attribute of that name in the keys module (see
+        api_keys_template.py); raises RuntimeError if neither is found.
+        '''
+    key = os.environ.get(name)
+    if key:
+        return key
 
-    markets_data = gpd.read_file(json.dumps(geographic_elements))
-    markets_data['addr'] = markets_data.apply(lambda row: f"{row['addr:housenumber']} {row['addr:street']}, {row['addr:city']}", axis=1)
-    markets_data['addr'] = markets_data['addr'].apply(lambda x: None if (str(x).find('None') != -1) else x)
+    try:
+        key = getattr(importlib.import_module(KEYS_MODULE), name, None)
+    except ImportError:
+        key = None
+
+    if key is None:
+        raise RuntimeError(f'No {name} found: set the {name} environment variable, '
+                           f'or add it to {KEYS_MODULE}.py')
+
+    return key
 
-    census_tracts = gpd.read_file('Geospatial_Data/NYC_Tracts.geojson').to_crs('epsg:4326')
 
-    markets_data_with_tract = gpd.sjoin(markets_data, census_tracts, how='left', op='intersects')
+def get_transport():
+    '''
+        Returns the transport used for upstream API calls, creating it on
+        first use.
+        '''
+    global TRANSPORT
+    with TRANSPORT_LOCK:
+        if TRANSPORT is None:
+            TRANSPORT = make_transport(os.environ.get('FOOD_ACCESS_FIXTURES'),
+                                       record=os.environ.get('FOOD_ACCESS_RECORD') == '1',
+                                       max_per_host=ORS_MAX_IN_FLIGHT)
+    return TRANSPORT
+
 
-    markets_data_with_tract.to_file('Geospatial_Data/markets.geojson', driver='GeoJSON')
+def call_API_to_file(url, params, file_path, reset_cache=False):
+    '''
+        Streams an API response to a file, unless a cached copy already exists.
+
+        Parameters
+        ----------
+        url: string
+            The location of a resource to be requested.
+
+        params: dict
+            A dictionary containing search parameters.
+
+        file_path: str
+            The path at which the response is cached.
+
+        reset_cache: bool
+            If True, ignores any cached response and fetches afresh.
+
+
+        Returns
+        -------
+        str
+            The path to the cached response.
+        '''
+    cache_name = os.path.splitext(os.path.basename(file_path))[0]
+
+    if reset_cache == False and os.path.exists(file_path):
+        print(f"Using Cache: {url}")
+        count(f'cache.{cache_name}.hits')
+        return file_path
+
+    print(f"Fetching: {url}")
+    count(f'cache.{cache_name}.misses')
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    #Download to a temporary file so an interrupted fetch leaves no partial cache
+    with timed(f'http.{cache_name}'):
+        get_transport().download(url, f'{file_path}.part', params=params)
+    os.replace(f'{file_path}.part', file_path)
+    record_written(file_path)
+
+    return file_path
+
+
+def get_market_data(refresh=False):
+    '''
+        Fetches markets from the Overpass API, assigns each to a census tract,
+        and saves them to Geospatial_Data/markets.geojson and the map database.
+
+        Parameters
+        ----------
+        refresh: bool
+            If True, ignores any cached Overpass response.
+
+
+        Returns
+        -------
+        GeoDataFrame
+            Markets, with the tags in MARKET_TAGS, an "addr" column and the
+            GEOID of each market's tract.
+        '''
+
+    results_path = call_API_to_file(url=overpass_url,
+                                    params={'data':overpass_query_markets},
+                                    file_path=OVERPASS_CACHE_PATH, reset_cache=refresh)
+
+    with open(results_path, 'rb') as results_file, timed('markets.parse'):
+        markets_data = parse_points(results_file, MARKET_TAGS)
+
+    markets_data['addr'] = (markets_data['addr:housenumber'] + ' ' + markets_data['addr:street']
+                            + ', ' + markets_data['addr:city'])
+
+    with timed('markets.assign_tracts'):
+        markets_data_with_tract = get_tract_index().assign_frame(markets_data)
+
+    save_layer(markets_data_with_tract, 'markets')
 
     fields_to_keep = ['id', 'name', 'alt_name', 'addr', 'shop', 'opening_hours', 'phone', 'GEOID']
-    make_markets_table(markets_data_with_tract[fields_to_keep])
+    make_markets_table(markets_data_with_tract[fields_to_keep].assign(lon=markets_data_with_tract.geometry.x,
+                                                                      lat=markets_data_with_tract.geometry.y))
 
-    return geographic_elements
+    return markets_data_with_tract
 
 
 
 
 def make_markets_table(geodataframe):
-    '''TODO: Docstring'''
+    '''
+        Writes market attributes to the "markets" table of the map database,
+        keyed by OSM id and indexed on tract GEOID, shop type and location.
 
-    conn = sqlite3.connect('Geospatial_Data/map_data.sqlite')
-    cur = conn.cursor()
+        Parameters
+        ----------
+        geodataframe: GeoDataFrame
+            Markets, with columns id, name, alt_name, addr, shop,
+            opening_hours, phone, GEOID, lon and lat.
 
-    create_statement = '''CREATE TABLE IF NOT EXISTS "markets"(
-    "feat_id" INTEGER PRIMARY KEY,
-    "name" TEXT,
-    "alt_name" TEXT,
-    "addr" TEXT,
-    "shop" TEXT,
-    "opening_hours" TEXT,
-    "phone" TEXT,
-    "GEOID" TEXT)'''
 
+        Returns
+        -------
+        None
+        '''
+    dataframe = pd.DataFrame(geodataframe).rename(columns={'id': 'feat_id'})
 
-    drop_statement = f'''DROP TABLE IF EXISTS "markets"'''
+    map_db.bulk_load('markets', dataframe, primary_key='feat_id', indexes=['GEOID', 'shop'],
+                     point_index=('lon', 'lat'))
 
-    conn.execute(drop_statement)
-    conn.execute(create_statement)
 
-    def add_row(row):
-        add_statement = '''INSERT INTO markets
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
-        values = row.values.tolist()
-        conn.execute(add_statement, values)
 
-    geodataframe.apply(lambda row: add_row(row), axis=1)
-    conn.commit()
-    conn.close()
 
+def morton_codes(x, y, bits=16):
+    '''
+        Returns the Morton (Z-order) code of each point, interleaving the bits
+        of its coordinates scaled to the bounds of all the points. Sorting by
+        these codes places nearby points close together.
+        '''
+    def scale(values):
+        span = values.max() - values.min()
+        scaled = (values - values.min()) / span if span > 0 else np.zeros(len(values))
+        return np.minimum(scaled*(1 << bits), (1 << bits) - 1).astype(np.uint64)
+
+    x, y = scale(np.asarray(x, dtype=float)), scale(np.asarray(y, dtype=float))
+    codes = np.zeros(len(x), dtype=np.uint64)
+    for bit in range(bits):
+        codes |= ((x >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2*bit)
+        codes |= ((y >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2*bit + 1)
+
+    return codes
+
+
+def divide_features(feature_df, n, geometry_col='geometry', id_col='id', max_payload_bytes=None):
+    '''
+        Divides points into batches for isochrone requests, grouping nearby
+        points together.
+
+        Points are ordered along a Morton curve and taken in turn into batches
+        of at most n points, starting a new batch early if the batch's
+        locations would exceed max_payload_bytes once encoded as JSON.
+
+        Parameters
+        ----------
+        feature_df: GeoDataFrame
+            Points in EPSG:4326; it is not modified.
+
+        n: int
+            The most locations the provider accepts per request.
+
+        geometry_col: str
+            The column holding point geometries.
+
+        id_col: str
+            The column holding point ids.
+
+        max_payload_bytes: int
+            The largest encoded size allowed for a batch's locations, if any.
+
+
+        Returns
+        -------
+        dict
+            A dictionary whose keys are tuples of the ids in each batch (as
+            strings), and whose values are the matching lists of
+            [longitude, latitude] pairs.
+        '''
+    if len(feature_df) == 0:
+        return {}
 
+    coords = shapely.get_coordinates(feature_df[geometry_col].to_numpy())
+    ids = feature_df[id_col].astype(str).to_numpy()
+    order = np.argsort(morton_codes(coords[:, 0], coords[:, 1]), kind='stable')
 
+    batches = {}
+    batch_ids, batch_locations, batch_bytes = [], [], 2
+    for i in order:
+        location = coords[i].tolist()
+        location_bytes = len(json.dumps(location)) + 2
 
-def divide_features(feature_df, n, geometry_col, id_col):
-    '''TODO: Write Docstring'''
-    ids_with_locations = {}
+        if batch_ids and (len(batch_ids) == n or (max_payload_bytes is not None
+                                                  and batch_bytes + location_bytes > max_payload_bytes)):
+            batches[tuple(batch_ids)] = batch_locations
+            batch_ids, batch_locations, batch_bytes = [], [], 2
 
-    feature_df['geom_reformat'] = feature_df[geometry_col].apply(lambda location: [location.x, location.y])
+        batch_ids.append(ids[i])
+        batch_locations.append(location)
+        batch_bytes += location_bytes
 
-    df_chunks = np.array_split(feature_df[[id_col, 'geom_reformat']], math.trunc(feature_df.shape[0]/5)+1)
+    batches[tuple(batch_ids)] = batch_locations
 
-    for chunk in df_chunks:
-        id_string = ''
+    return batches
 
-        for item in chunk[id_col].tolist():
-            id_string += f'{item}_'
 
-        location_list = chunk['geom_reformat'].tolist()
+def make_isochrone_provider(header):
+    '''
+        Returns the isochrone provider used by get_isochrones_with_cache: a
+        LocalIsochroneEngine if STREET_GRAPH_PATH is set, otherwise an
+        IsochroneScheduler for the OpenRouteService API.
 
-        ids_with_locations[id_string] = location_list
+        Providers accept a dictionary of ORS request payloads through
+        run(jobs, on_result), and pass ORS-shaped responses to on_result.
+        '''
+    if STREET_GRAPH_PATH:
+        print(f"Computing isochrones locally from {STREET_GRAPH_PATH}")
+        return LocalIsochroneEngine(StreetGraph.from_file(STREET_GRAPH_PATH))
 
+    #The key is only needed, and looked up, when calling OpenRouteService
+    return IsochroneScheduler(ORS_URL, dict(header, Authorization=api_key(ORS_KEY_NAME)),
+                              requests_per_minute=ORS_REQUESTS_PER_MINUTE,
+                              max_in_flight=ORS_MAX_IN_FLIGHT,
+                              post=get_transport().post)
 
-    return ids_with_locations
 
+def get_isochrones_with_cache(points, cache_name):
+    '''
+        Fetches isochrones for the points provided, saving the isochrones for
+        each point to the cache under its id as each batch arrives.
 
-def get_isochrones_with_cache(points, layer_cache):
-    '''TODO: Docstring
+        Parameters
+        ----------
+        points: GeoDataFrame
+            Points in EPSG:4326, with an "id" column.
 
-    Returns dictionary containing an index and a list of GeoJSON Features'''
+        cache_name: str
+            The name of the cache in which isochrones are stored.
 
-    points_data = gpd.read_file(json.dumps(points))
 
-    segments = divide_features(points_data, 5, 'geometry', 'id')
+        Returns
+        -------
+        dict
+            "index": the ids of the points whose isochrones were fetched;
+            "features": their isochrones, as GeoJSON Features; and "failed":
+            the ids of points whose isochrones could not be fetched.
+        '''
 
     params = {'location_type':'destination',
               'range': [600, 420, 300], #420/60 = 7 mins
@@ -320,125 +545,179 @@ def get_isochrones_with_cache(points, layer_cache):
 
     header = {
         'Accept': 'application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8',
-        'Authorization': ORS_KEY,
         'Content-Type': 'application/json; charset=utf-8'
     }
 
-    isochrone_features = layer_cache['GeoJSON']['features']
-    index = layer_cache['index']
+    provider = make_isochrone_provider(header)
+    segments = divide_features(points, provider.max_locations, 'geometry', 'id',
+                               max_payload_bytes=provider.max_payload_bytes)
 
-    segment_number = 1
-    for id_string, locations in segments.items():
-        params['locations'] = locations
-        params['id'] = id_string
-        id_list = np.repeat(id_string.split(sep='_'), len(params['range'])).tolist()
-        index += id_list
+    isochrone_features = []
+    index = []
+    segment_number = 0
 
-        try:
-            isos = requests.post(ORS_URL, json=params, headers=header).json()
+    jobs = {}
+    for ids, locations in segments.items():
+        jobs[ids] = dict(params, locations=locations)
 
-            i = 0
-            for feature in isos['features']:
-                feature['properties']['id'] = id_list[i]
-                i += 1
-                isochrone_features.append(feature)
+    def store_segment(ids, isos):
+        nonlocal segment_number
+        id_list = np.repeat(ids, len(params['range'])).tolist()
 
-            save_cache(layer_cache, layer_cache['GeoJSON']['name'])
-            print(f"Fetched New Isochrones: Segment {segment_number} of {len(segments.keys())}")
-            segment_number +=1
+        features_by_id = {}
+        for feature, feat_id in zip(isos['features'], id_list):
+            feature['properties']['id'] = feat_id
+            features_by_id.setdefault(feat_id, []).append(feature)
+            isochrone_features.append(feature)
 
-        except:
-            print("Waiting one minute...")
-            time.sleep(61)
+        with timed('cache.write'):
+            CACHE_VAR.put_many(cache_name, features_by_id)
+        index.extend(features_by_id.keys())
 
-            isos = requests.post(ORS_URL, json=params, headers=header).json()
+        segment_number += 1
+        print(f"Fetched New Isochrones: Segment {segment_number} of {len(jobs)}")
 
-            i = 0
-            for feature in isos['features']:
-                feature['properties']['id'] = id_list[i]
-                i += 1
-                isochrone_features.append(feature)
+    count('isochrones.jobs', len(jobs))
+    with timed('isochrones.fetch'):
+        failures = provider.run(jobs, store_segment)
 
-            save_cache(layer_cache, layer_cache['GeoJSON']['name'])
-            print(f"Fetched New Isochrones: Segment {segment_number} of {len(segments.keys())}")
-            segment_number +=1
+    count('isochrones.failed_jobs', len(failures))
+    for ids, error in failures.items():
+        print(f"Failed to fetch isochrones for {', '.join(ids)}: {error}")
 
-    return {'index': index, 'features': isochrone_features}
+    failed = [feat_id for ids in failures for feat_id in ids]
 
+    return {'index': index, 'features': isochrone_features, 'failed': failed}
 
-def refresh_isochrones(point_feature_collection, layer_name):
-    '''TODO: Docstring
 
-    point_feature_collection: GeoJSON,
-    returns GeoJSON of '''
+def diff_snapshot(current, previous, tolerance=1e-6):
+    '''
+        Compares two snapshots of point locations, keyed by id.
 
-    layer_cache = CACHE_VAR.setdefault(f'{layer_name}_isochrones', {'index':[],'GeoJSON':{
-        'type': 'FeatureCollection',
-        'name': f'{layer_name}_isochrones',
-        'features':[]
-        }
-        })
+        Parameters
+        ----------
+        current: dict
+            The latest locations, as {id: [lon, lat]}.
+
+        previous: dict
+            The locations recorded on the previous refresh.
+
+        tolerance: float
+            The largest change in either coordinate, in degrees, not treated
+            as a move.
 
-    features_in_cache = []
-    features_to_fetch = []
 
-    for feature in point_feature_collection['features']:
-        if str(feature['properties']['id']) in layer_cache['index']:
-            features_in_cache.append(feature)
-        else:
-            features_to_fetch.append(feature)
+        Returns
+        -------
+        tuple
+            Sets of the ids added, moved and removed since the previous snapshot.
+        '''
+    added = current.keys() - previous.keys()
+    removed = previous.keys() - current.keys()
 
-    print(f'''Using {len(features_in_cache)} cached isochrones;
-                Fetching {len(features_to_fetch)} new isochrones''')
+    moved = set()
+    for key in current.keys() & previous.keys():
+        (lon, lat), (old_lon, old_lat) = current[key], previous[key]
+        if abs(lon - old_lon) > tolerance or abs(lat - old_lat) > tolerance:
+            moved.add(key)
 
-    if len(features_to_fetch) >0:
-        new_isochrones = get_isochrones_with_cache({'type': 'FeatureCollection',
-                                        'name': 'temp',
-                                        'features': features_to_fetch}, layer_cache)
+    return added, moved, removed
 
-        layer_cache['index'] += new_isochrones['index']
-        layer_cache['GeoJSON']['features'] += new_isochrones['features']
 
-    save_cache(layer_cache, f'{layer_name}_isochrones')
+def refresh_isochrones(points, layer_name):
+    '''
+        Brings the cached isochrones for a point layer up to date, fetching
+        isochrones only for points added or moved since the previous refresh
+        and evicting those of points that have been removed.
 
-    with open('Geospatial_Data/isochrones.geojson', 'w') as file:
-        json.dump(layer_cache['GeoJSON'], file, indent=2)
+        Saves the resultant isochrones as the "isochrones" layer in Geospatial_Data.
 
-    return layer_cache['GeoJSON']
+        Parameters
+        ----------
+        points: GeoDataFrame
+            Points in EPSG:4326, with an "id" column.
 
+        layer_name: str
+            The name of the point layer, used to name its caches.
 
-def make_tracts_table(geodataframe):
-    '''TODO: Docstring'''
 
-    conn = sqlite3.connect('Geospatial_Data/map_data.sqlite')
-    cur = conn.cursor()
+        Returns
+        -------
+        GeoDataFrame
+            Isochrones, with the id of the point each belongs to.
+        '''
+
+    cache_name = f'{layer_name}_isochrones'
+    snapshot_name = f'{layer_name}_snapshot'
+
+    point_ids = points['id'].astype(str)
+    current = dict(zip(point_ids, zip(points.geometry.x.tolist(), points.geometry.y.tolist())))
+    previous = dict(CACHE_VAR.items(snapshot_name))
+    cached_ids = CACHE_VAR.keys(cache_name)
+
+    _, moved, _ = diff_snapshot(current, previous)
+
+    #New points, plus any never fetched successfully, lack cached isochrones;
+    #points cached before snapshots were kept are treated as unmoved
+    missing = current.keys() - cached_ids
+    moved &= cached_ids
+    removed = cached_ids - current.keys()
+
+    CACHE_VAR.delete(cache_name, moved | removed)
+
+    points_to_fetch = points[point_ids.isin(missing | moved).to_numpy()]
+    count(f'cache.{cache_name}.hits', len(current) - len(points_to_fetch))
+    count(f'cache.{cache_name}.misses', len(points_to_fetch))
+
+    print(f'''Using {len(current) - len(points_to_fetch)} cached isochrones;
+                Fetching {len(missing)} new and {len(moved)} moved isochrones;
+                Dropping {len(removed)} removed isochrones''')
+
+    failed = []
+    if len(points_to_fetch) >0:
+        failed = get_isochrones_with_cache(points_to_fetch, cache_name)['failed']
 
-    dataframe = geodataframe.drop(columns=['geometry'])
-    value_cols = [column for column in dataframe.columns.tolist() if column != 'GEOID']
+    CACHE_VAR.clear(snapshot_name)
+    CACHE_VAR.put_many(snapshot_name, current)
 
-    schema = '''"geoid" TEXT PRIMARY KEY UNIQUE'''
+    with timed('isochrones.load_cached'):
+        features = [feature for features in CACHE_VAR.values(cache_name) for feature in features]
+        isochrones = gpd.GeoDataFrame.from_features(features, crs='epsg:4326')
 
-    for column in value_cols:
-        schema += f''',
-        "{str(column).lower()}" TEXT NOT NULL'''
+    save_layer(isochrones, 'isochrones')
 
-    drop_statement = '''DROP TABLE IF EXISTS "tracts";'''
-    create_statement = f'''CREATE TABLE IF NOT EXISTS "tracts"(
-    {schema})'''
+    #Precompute the unions and bands drawn on the market map
+    with timed('isochrones.unions'):
+        load_or_build_unions(isochrones)
 
-    cur.execute(drop_statement)
-    cur.execute(create_statement)
+    #Fail the pipeline stage, so that it is not marked current and the next
+    #refresh retries these points; isochrones fetched so far remain cached
+    if failed:
+        raise RuntimeError(f'Failed to fetch isochrones for {len(failed)} points; '
+                           'run the refresh again to retry them')
 
-    def add_to_table(row):
-        add_statement = f'''INSERT INTO tracts
-        VALUES (?{', ?'*(len(row.values)-1)})'''
-        values = [row['GEOID']]+row[value_cols].values.tolist()
-        conn.execute(add_statement, values)
+    return isochrones
 
-    dataframe.apply(lambda row: add_to_table(row), axis=1)
 
-    conn.commit()
-    conn.close()
+def make_tracts_table(geodataframe):
+    '''
+        Writes tract attributes to the "tracts" table of the map database,
+        keyed by GEOID, with column names in lower case.
+
+        Parameters
+        ----------
+        geodataframe: GeoDataFrame
+            Tracts with ACS data joined.
+
+
+        Returns
+        -------
+        None
+        '''
+    dataframe = pd.DataFrame(geodataframe.drop(columns=['geometry']))
+    dataframe.columns = [str(column).lower() for column in dataframe.columns]
+
+    map_db.bulk_load('tracts', dataframe, primary_key='geoid')
 
 
 
@@ -459,67 +738,125 @@ def get_acs_data():
                  'median_hh_income':'B19049_001E'
                 }
 
-    tracts_table = gpd.read_file('Geospatial_Data/NYC_Tracts_Clipped.geojson')
+    #One request per county retrieves every variable at once
+    county_tables = []
+    for county in county_fips:
+        params = {'get':','.join(variables.values()),
+                  'for':'tract:*',
+                  'in':[f"state:{state_fips}",f"county:{county}"],
+                  'key':api_key(CENSUS_KEY_NAME)
+               }
 
-    for varname, variable in variables.items():
-        variable_table = pd.DataFrame({f'{variable}':'Placeholder',
-                                       'state':'00',
-                                       'county':'000',
-                                       'tract':'000000'}, index=[0])
-        for county in county_fips:
-            params = {'get':variable,
-                      'for':'tract:*',
-                      'in':[f"state:{state_fips}",f"county:{county}"],
-                      'key':CENSUS_KEY
-                   }
+        results = call_API_with_cache(url=BASE_URL,
+                                      params=params,
+                                      cache_name='census')
+        county_tables.append(pd.DataFrame(results[1:], columns=results[0]))
 
-            results = call_API_with_cache(url=BASE_URL,
-                                          params=params,
-                                          cache_name='census')
-            variable_table = variable_table.append(pd.DataFrame(results, columns=variable_table.columns).iloc[1:,0:], ignore_index=True)
+    variable_table = pd.concat(county_tables, ignore_index=True)
 
-        tracts_table = tracts_table.merge(variable_table,
-                                          left_on=['STATEFP', 'COUNTYFP', 'TRACTCE'],
-                                          right_on=['state', 'county', 'tract'],
-                                          how='left').drop(columns=['state', 'county', 'tract'])
+    value_cols = list(variables.values())
+    variable_table[value_cols] = variable_table[value_cols].apply(pd.to_numeric, errors='coerce')
 
-    tracts_table = tracts_table[tracts_table['B01003_001E'].astype(int) != 0]
+    #Negative values are Census annotations (e.g. -666666666: not computed)
+    variable_table[value_cols] = variable_table[value_cols].where(variable_table[value_cols] >= 0)
 
-    tracts_table['B01002_001E'] = tracts_table['B01002_001E'].apply(lambda item: np.nan if float(item)<0 else item).astype(str)
+    variable_table['GEOID'] = variable_table['state'] + variable_table['county'] + variable_table['tract']
+    variable_table = variable_table.drop(columns=['state', 'county', 'tract'])
+    variable_table = variable_table[variable_table['B01003_001E'] != 0]
 
-    tracts_table['B19049_001E'] = tracts_table['B19049_001E'].apply(lambda item: np.nan if float(item)<0 else item).astype(str)
+    variable_table['pct_nonwhite'] = 1 - variable_table['B02001_002E']/variable_table['B01003_001E']
 
-    tracts_table['pct_nonwhite'] = tracts_table.apply(lambda row: 1-(int(row['B02001_002E'])/int(row['B01003_001E'])), axis=1)
+    tracts_table = gpd.read_file('Geospatial_Data/NYC_Tracts_Clipped.geojson')
+    with timed('tracts.merge'):
+        tracts_table = tracts_table.merge(variable_table, on='GEOID', how='inner')
 
-    tracts_table.to_file('Geospatial_Data/Tracts_with_Data.geojson', driver='GeoJSON')
+    save_layer(tracts_table, 'Tracts_with_Data')
 
     make_tracts_table(tracts_table)
 
     return tracts_table
 
-if __name__ == '__main__':
-    #Initialize Cache
-    CACHE_VAR = open_cache(CACHE_PATH)
+def make_nearest_stage(tracts, markets):
+    return make_nearest_table(tracts, MarketIndex.from_frame(markets))
 
-    #Fetch Markets
-    markets = get_market_data()
 
-    #Fetch and Categorize Isochrones
-    isochrones = refresh_isochrones(markets, 'markets')
+def build_pipeline(refresh_markets=False):
+    '''
+        Returns the data pipeline. The market and tract stages are independent
+        and run concurrently; isochrones follow markets, and the access
+        measures follow both.
 
-    #Fetch and Join Tract Data
-    get_acs_data()
+        If refresh_markets is True, the markets stage ignores any cached
+        Overpass response.
+        '''
+    markets_path = 'Geospatial_Data/markets.parquet'
+    isochrones_path = 'Geospatial_Data/isochrones.parquet'
+    tracts_path = 'Geospatial_Data/Tracts_with_Data.parquet'
+
+    stages = [Stage('markets', partial(get_market_data, refresh=refresh_markets),
+                    inputs=[OVERPASS_CACHE_PATH, 'Geospatial_Data/NYC_Tracts.geojson'],
+                    outputs=[markets_path, map_db.DB_PATH],
+                    load=lambda: load_layer('markets'),
+                    version=MARKETS_SCHEMA_VERSION),
+              Stage('isochrones', partial(refresh_isochrones, layer_name='markets'),
+                    deps=['markets'],
+                    inputs=[markets_path],
+                    outputs=[isochrones_path, UNIONS_PATH],
+                    load=lambda: load_layer('isochrones')),
+              Stage('tracts', get_acs_data,
+                    inputs=['Geospatial_Data/NYC_Tracts_Clipped.geojson'],
+                    outputs=[tracts_path, map_db.DB_PATH],
+                    load=lambda: load_layer('Tracts_with_Data')),
+              Stage('access', make_access_table,
+                    deps=['tracts', 'isochrones'],
+                    inputs=[tracts_path, isochrones_path],
+                    outputs=[map_db.DB_PATH]),
+              Stage('nearest', make_nearest_stage,
+                    deps=['tracts', 'markets'],
+                    inputs=[tracts_path, markets_path],
+                    outputs=[map_db.DB_PATH])]
+
+    return Pipeline(stages)
+
+
+def run_pipeline(force=(), force_all=False, profile=()):
+    '''
+        Opens the cache and runs the data pipeline, writing a report of the
+        run's stage timings, peak memory, cache hits, requests and waits to
+        Cache/reports/fetch.json.
 
+        Parameters
+        ----------
+        force: iterable
+            Names of stages to re-run even if their inputs are unchanged.
+            Forcing the markets stage fetches markets afresh from Overpass.
 
-if __name__ == 'get_data':
-    #Initialize Cache
+        force_all: bool
+            If True, every stage is re-run.
+
+        profile: iterable
+            Names of stages to run under cProfile, writing their statistics
+            to Cache/reports/<stage>.prof.
+
+
+        Returns
+        -------
+        dict
+            The result of each stage, keyed by name.
+        '''
+    global CACHE_VAR
     CACHE_VAR = open_cache(CACHE_PATH)
+    RECORDER.reset()
 
-    #Fetch Markets
-    markets = get_market_data()
+    pipeline = build_pipeline(refresh_markets=force_all or 'markets' in force)
+    if force_all:
+        force = list(pipeline.stages)
 
-    #Fetch and Categorize Isochrones
-    isochrones = refresh_isochrones(markets, 'markets')
+    try:
+        return pipeline.run(force=force, profile=profile)
+    finally:
+        print(f"Run report saved to {RECORDER.write_report('fetch')}")
 
-    #Fetch and Join Tract Data
-    get_acs_data()
+
+if __name__ == '__main__':
+    run_pipeline()
@@ -0,0 +1,154 @@
+#Imports
+import cProfile
+import json
+import os
+import platform
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+REPORT_DIR = './Cache/reports'
+
+
+def peak_rss_mb():
+    '''
+        Returns the peak resident memory of this process so far, in MB.
+        '''
+    #ru_maxrss is in kilobytes on Linux, and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if platform.system() == 'Darwin' else peak / 1024
+
+
+class Recorder:
+    '''
+        Collects durations, counters and stage measurements over a run, from
+        any thread, and writes them as a JSON report.
+
+        Timers accumulate the number of calls and the total and longest time
+        spent under a name; counters accumulate numbers (requests, cache hits,
+        bytes written, seconds spent waiting). Names are dotted, e.g.
+        "cache.census.hits" or "http.census".
+        '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.timers = {}
+            self.counters = {}
+            self.stages = {}
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            timer['calls'] += 1
+            timer['seconds'] += seconds
+            timer['max_seconds'] = max(timer['max_seconds'], seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def set_stage(self, name, measurements):
+        with self.lock:
+            self.stages[name] = measurements
+
+    def report(self):
+        '''
+            Returns the measurements recorded since the last reset.
+            '''
+        with self.lock:
+            hit_ratios = {}
+            for name, hits in self.counters.items():
+                if name.endswith('.hits'):
+                    misses = self.counters.get(name[:-len('hits')] + 'misses', 0)
+                    hit_ratios[name[:-len('.hits')]] = round(hits / (hits + misses), 4)
+
+            return {'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                    'seconds': round(time.time() - self.started, 3),
+                    'peak_rss_mb': round(peak_rss_mb(), 1),
+                    'stages': dict(self.stages),
+                    'timers': {name: {'calls': timer['calls'],
+                                      'seconds': round(timer['seconds'], 4),
+                                      'max_seconds': round(timer['max_seconds'], 4)}
+                               for name, timer in sorted(self.timers.items())},
+                    'counters': {name: round(value, 4) if isinstance(value, float) else value
+                                 for name, value in sorted(self.counters.items())},
+                    'cache_hit_ratios': hit_ratios}
+
+    def write_report(self, name, report_dir=REPORT_DIR):
+        '''
+            Writes the report to "<report_dir>/<name>.json" and returns its path.
+            '''
+        os.makedirs(report_dir, exist_ok=True)
+        path = os.path.join(report_dir, f'{name}.json')
+        with open(path, 'w') as report_file:
+            json.dump(dict(self.report(), run=name), report_file, indent=2)
+
+        return path
+
+
+#The recorder shared by every module of a run
+RECORDER = Recorder()
+
+timed = RECORDER.timed
+count = RECORDER.count
+add_time = RECORDER.add_time
+
+
+def measure(func, *args, profile_path=None):
+    '''
+        Calls func(*args), returning its result and a dictionary of its
+        duration in seconds and the peak memory of the process when it
+        finished. If profile_path is given, the call is profiled with cProfile
+        and the statistics are written there, for reading with pstats or
+        snakeviz.
+        '''
+    profiler = cProfile.Profile() if profile_path is not None else None
+
+    start = time.perf_counter()
+    if profiler is not None:
+        result = profiler.runcall(func, *args)
+    else:
+        result = func(*args)
+    seconds = time.perf_counter() - start
+
+    measurements = {'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+    if profiler is not None:
+        os.makedirs(os.path.dirname(profile_path) or '.', exist_ok=True)
+        profiler.dump_stats(profile_path)
+        measurements['profile'] = profile_path
+
+    return result, measurements
+
+
+def profile_path(stage_name, report_dir=REPORT_DIR):
+    return os.path.join(report_dir, f'{stage_name}.prof')
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def record_written(*paths):
+    '''
+        Adds the sizes of files just written to the "bytes_written" counter.
+        '''
+    count('bytes_written', sum(file_size(path) for path in paths))
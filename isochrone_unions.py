@@ -0,0 +1,155 @@
+#Imports
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+
+UNIONS_PATH = 'Geospatial_Data/isochrone_unions.parquet'
+RANGES = {'5min': 300, '7min': 420, '10min': 600}
+
+
+def travel_times(isochrones):
+    '''
+        Returns the "value" column of a set of isochrones as floats; a frame
+        built from no features has no such column, and gives an empty array.
+        '''
+    if 'value' not in isochrones.columns:
+        return np.empty(len(isochrones), dtype=float)
+
+    return isochrones['value'].to_numpy(dtype=float)
+
+
+def content_hash(isochrones):
+    '''
+        Returns a hash of the travel times and geometries of a set of isochrones.
+        '''
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(travel_times(isochrones)).tobytes())
+    for wkb in shapely.to_wkb(isochrones.geometry.to_numpy()):
+        digest.update(wkb)
+
+    return digest.hexdigest()
+
+
+def cascaded_union(geometries, chunk_size=2000, workers=None):
+    '''
+        Unions an array of geometries by unioning chunks of it in parallel
+        processes, then unioning the partial results.
+
+        Parameters
+        ----------
+        geometries: ndarray
+            The geometries to be unioned.
+
+        chunk_size: int
+            The number of geometries unioned by each process at a time.
+
+        workers: int
+            The number of processes; defaults to the number of CPUs. If 1, or
+            if there is only a single chunk, the union runs in this process.
+
+
+        Returns
+        -------
+        Geometry
+        '''
+    chunks = [geometries[start:start + chunk_size] for start in range(0, len(geometries), chunk_size)]
+
+    if len(chunks) > 1 and workers != 1:
+        #Pipeline stages run in threads; forking a threaded process can deadlock
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('forkserver')) as executor:
+            partials = list(executor.map(shapely.union_all, chunks))
+    else:
+        partials = [shapely.union_all(chunk) for chunk in chunks]
+
+    return shapely.union_all(partials)
+
+
+def build_isochrone_unions(isochrones, workers=None):
+    '''
+        Builds the 5, 7 and 10-minute isochrone unions, along with mutually
+        exclusive bands (the 7-minute band excludes the area within 5 minutes,
+        and the 10-minute band the area within 7 minutes).
+
+        Parameters
+        ----------
+        isochrones: GeoDataFrame
+            Isochrones with a "value" column giving travel time in seconds.
+
+        workers: int
+            The number of processes used for each union.
+
+
+        Returns
+        -------
+        GeoDataFrame
+            One row per union and band, with columns "layer", "kind" ("union"
+            or "band") and "seconds".
+        '''
+    values = travel_times(isochrones)
+
+    unions = {}
+    for layer, seconds in RANGES.items():
+        geometries = isochrones.geometry.to_numpy()[values == seconds]
+        unions[layer] = cascaded_union(geometries, workers=workers)
+
+    bands = {'5min': unions['5min'],
+             '7min': shapely.difference(unions['7min'], unions['5min']),
+             '10min': shapely.difference(unions['10min'], unions['7min'])}
+
+    rows = [(layer, 'union', RANGES[layer], geometry) for layer, geometry in unions.items()]
+    rows += [(layer, 'band', RANGES[layer], geometry) for layer, geometry in bands.items()]
+
+    return gpd.GeoDataFrame(rows, columns=['layer', 'kind', 'seconds', 'geometry'],
+                            geometry='geometry', crs=isochrones.crs)
+
+
+def load_or_build_unions(isochrones, unions_path=UNIONS_PATH, workers=None):
+    '''
+        Returns the isochrone unions and bands saved at unions_path if they
+        were built from the same isochrones; otherwise builds and saves them.
+
+        Parameters
+        ----------
+        isochrones: GeoDataFrame
+            Isochrones with a "value" column giving travel time in seconds.
+
+        unions_path: str
+            The GeoParquet file in which unions are saved.
+
+        workers: int
+            The number of processes used for each union.
+
+
+        Returns
+        -------
+        GeoDataFrame
+            As returned by build_isochrone_unions, with a "source_hash" column.
+        '''
+    source_hash = content_hash(isochrones)
+
+    if os.path.exists(unions_path):
+        saved = gpd.read_parquet(unions_path)
+        if len(saved) > 0 and (saved['source_hash'] == source_hash).all():
+            return saved
+
+    unions = build_isochrone_unions(isochrones, workers=workers)
+    unions['source_hash'] = source_hash
+    unions.to_parquet(unions_path, index=False)
+
+    return unions
+
+
+def as_layers(unions, kind='union'):
+    '''
+        Returns a dictionary of the union or band geometries, keyed by layer
+        name ('5min', '7min', '10min').
+        '''
+    selected = unions[unions['kind'] == kind]
+    return dict(zip(selected['layer'], selected.geometry))
@@ -0,0 +1,44 @@
+#Imports
+import os
+
+import geopandas as gpd
+
+
+DATA_DIR = 'Geospatial_Data'
+
+ACS_COLUMNS = ['B01003_001E', 'B02001_002E', 'B02001_003E', 'B02001_004E', 'B02001_005E',
+               'B02001_006E', 'B02001_007E', 'B02001_008E', 'B01002_001E', 'B19049_001E']
+
+
+def load_layer(layer_name, columns=None, bbox=None):
+    '''
+        Loads a layer saved by get_data.py, preferring its GeoParquet copy and
+        falling back to GeoJSON where no current GeoParquet copy exists.
+
+        Parameters
+        ----------
+        layer_name: str
+            The file name of the layer in Geospatial_Data, without extension.
+
+        columns: list
+            The attribute columns to be read; defaults to all columns.
+
+        bbox: tuple
+            If provided, only features intersecting (minx, miny, maxx, maxy)
+            are read.
+
+
+        Returns
+        -------
+        GeoDataFrame
+        '''
+    parquet_path = f'{DATA_DIR}/{layer_name}.parquet'
+    geojson_path = f'{DATA_DIR}/{layer_name}.geojson'
+
+    if os.path.exists(parquet_path) and (not os.path.exists(geojson_path)
+                                         or os.path.getmtime(parquet_path) >= os.path.getmtime(geojson_path)):
+        if columns is not None:
+            columns = columns + ['geometry']
+        return gpd.read_parquet(parquet_path, columns=columns, bbox=bbox)
+
+    return gpd.read_file(geojson_path, columns=columns, bbox=bbox)
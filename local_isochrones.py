@@ -0,0 +1,306 @@
+#Imports
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+#UTM zone 18N, in metres
+PROJECTED_CRS = 'epsg:32618'
+
+#OpenRouteService's foot-walking profile assumes 5 km/h
+WALKING_SPEED = 5/3.6
+
+#Locations further than this (in metres) from the street network are rejected, as by ORS
+MAX_SNAP_DISTANCE = 350
+
+#Reached street vertices are wrapped in a concave hull, then widened by EDGE_BUFFER metres
+CONCAVE_RATIO = 0.3
+EDGE_BUFFER = 25
+
+#OSM highway values excluded when reading an OSM extract
+NON_WALKABLE = ['motorway', 'motorway_link', 'trunk', 'trunk_link', 'construction', 'proposed']
+
+
+def load_edges(graph_path):
+    '''
+        Reads street edges from a line layer (e.g. GeoJSON) or, for ".osm"
+        and ".pbf" files, from the ways of an OpenStreetMap extract.
+        '''
+    if graph_path.endswith(('.osm', '.pbf')):
+        edges = gpd.read_file(graph_path, layer='lines', columns=['highway'])
+        return edges[edges['highway'].notna() & ~edges['highway'].isin(NON_WALKABLE)]
+
+    return gpd.read_file(graph_path)
+
+
+class StreetGraph:
+    '''
+        A walking network, weighted by travel time, built from street edges.
+
+        Every vertex of every edge becomes a node, so that streets crossing at
+        a shared vertex are connected; vertices are matched to within 10 cm.
+        Locations are snapped to the nearest point on any segment, not to the
+        nearest vertex, so that long blocks without intermediate vertices are
+        reached from their middle.
+
+        Parameters
+        ----------
+        edges: GeoDataFrame
+            Street centrelines, as LineStrings or MultiLineStrings.
+
+        speed: float
+            The walking speed, in metres per second.
+        '''
+
+    def __init__(self, edges, speed=WALKING_SPEED):
+        lines = shapely.get_parts(edges.to_crs(PROJECTED_CRS).geometry.to_numpy())
+        lines = lines[shapely.get_type_id(lines) == 1]
+
+        coords, line_idx = shapely.get_coordinates(lines, return_index=True)
+        self.nodes, node_idx = np.unique(coords.round(1), axis=0, return_inverse=True)
+        node_idx = node_idx.ravel()
+
+        #Consecutive vertices of the same line form a segment
+        same_line = line_idx[1:] == line_idx[:-1]
+        start, end = node_idx[:-1][same_line], node_idx[1:][same_line]
+        seconds = np.hypot(*(coords[1:] - coords[:-1])[same_line].T) / speed
+
+        #Keep the quickest of any parallel segments between the same pair of nodes
+        segments = pd.DataFrame({'start': np.minimum(start, end), 'end': np.maximum(start, end),
+                                 'seconds': seconds})
+        segments = segments[segments['start'] != segments['end']]
+        segments = segments.groupby(['start', 'end'], as_index=False)['seconds'].min()
+
+        self.starts = segments['start'].to_numpy()
+        self.ends = segments['end'].to_numpy()
+        self.seconds = segments['seconds'].to_numpy()
+        self.matrix = coo_matrix((self.seconds, (self.starts, self.ends)), shape=(len(self.nodes),)*2).tocsr()
+        self.speed = speed
+        self.to_projected = Transformer.from_crs('epsg:4326', PROJECTED_CRS, always_xy=True)
+        self.to_lonlat = Transformer.from_crs(PROJECTED_CRS, 'epsg:4326', always_xy=True)
+
+        self.build_segment_tree()
+
+    def build_segment_tree(self):
+        self.segments = shapely.linestrings(np.stack([self.nodes[self.starts], self.nodes[self.ends]], axis=1))
+        self.segment_tree = shapely.STRtree(self.segments)
+
+    def __getstate__(self):
+        #Rebuilding the segments is quicker than pickling them for worker processes
+        state = dict(self.__dict__)
+        del state['segments'], state['segment_tree']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.build_segment_tree()
+
+    @classmethod
+    def from_file(cls, graph_path, speed=WALKING_SPEED):
+        return cls(load_edges(graph_path), speed=speed)
+
+    def snap(self, x, y):
+        '''
+            Finds the nearest segment to each projected point, returning the
+            distances to the segments, the segments' positions and the points'
+            distances along them from their start nodes.
+            '''
+        points = shapely.points(x, y)
+        (_, segment_idx), distances = self.segment_tree.query_nearest(points, return_distance=True,
+                                                                       all_matches=False)
+        along = shapely.line_locate_point(self.segments[segment_idx], points)
+
+        return distances, segment_idx, along
+
+    def catchment(self, reached, center):
+        '''
+            Returns the polygon (in the projected CRS) covering the nodes reached.
+            '''
+        if len(reached) >= 3:
+            outline = shapely.concave_hull(shapely.multipoints(reached), ratio=CONCAVE_RATIO)
+        elif len(reached) > 0:
+            outline = shapely.multipoints(reached)
+        else:
+            outline = shapely.points(center)
+
+        return shapely.buffer(outline, EDGE_BUFFER)
+
+    def isochrones(self, locations, ranges):
+        '''
+            Computes walking isochrones around a batch of locations.
+
+            Each location is joined to the network at the nearest point on a
+            street segment, as a temporary node linked to both ends of the
+            segment. Travel times are then found by one Dijkstra search per
+            location over the network, each bounded by the largest range.
+
+            Parameters
+            ----------
+            locations: list
+                [longitude, latitude] pairs in EPSG:4326.
+
+            ranges: list
+                Travel times, in seconds.
+
+
+            Returns
+            -------
+            dict
+                A GeoJSON FeatureCollection with the same features and
+                properties as an OpenRouteService isochrones response: one
+                feature per location and range, grouped by location.
+                "total_pop" is not estimated and is always None.
+            '''
+        lons, lats = np.asarray(locations, dtype=float).T
+        x, y = self.to_projected.transform(lons, lats)
+        snap_distances, segment_idx, along = self.snap(x, y)
+
+        too_far = snap_distances > MAX_SNAP_DISTANCE
+        if too_far.any():
+            lon, lat = np.asarray(locations, dtype=float)[too_far][0]
+            raise ValueError(f'No street within {MAX_SNAP_DISTANCE} m of {lon}, {lat}')
+
+        #Link a node per location to both ends of its segment, by the time to walk
+        #to the street and along it; explicit zero weights would not be edges
+        n, m = len(self.nodes), len(locations)
+        sources = n + np.arange(m)
+        lengths = shapely.length(self.segments[segment_idx])
+        to_start = (snap_distances + along) / self.speed + 1e-9
+        to_end = (snap_distances + lengths - along) / self.speed + 1e-9
+
+        matrix = coo_matrix((np.concatenate([self.seconds, to_start, to_end]),
+                             (np.concatenate([self.starts, sources, sources]),
+                              np.concatenate([self.ends, self.starts[segment_idx], self.ends[segment_idx]]))),
+                            shape=(n + m,)*2).tocsr()
+
+        times = dijkstra(matrix, directed=False, indices=sources, limit=max(ranges))[:, :n]
+
+        snapped = shapely.get_coordinates(shapely.line_interpolate_point(self.segments[segment_idx], along))
+
+        features = []
+        for group_index in range(m):
+            center = list(self.to_lonlat.transform(*snapped[group_index]))
+
+            for value in ranges:
+                polygon = self.catchment(self.nodes[times[group_index] <= value], snapped[group_index])
+                area = polygon.area
+
+                geometry = shapely.transform(polygon, lambda coords: np.column_stack(
+                    self.to_lonlat.transform(coords[:, 0], coords[:, 1])))
+
+                features.append({'type': 'Feature',
+                                 'properties': {'group_index': group_index,
+                                                'value': float(value),
+                                                'center': center,
+                                                'area': round(area, 4),
+                                                'reachfactor': round(area / (math.pi*(value*self.speed)**2), 4),
+                                                'total_pop': None},
+                                 'geometry': shapely.geometry.mapping(geometry)})
+
+        return {'type': 'FeatureCollection', 'features': features}
+
+
+#The graph held by each worker process of a LocalIsochroneEngine
+_WORKER_GRAPH = None
+
+
+def _init_worker(graph):
+    global _WORKER_GRAPH
+    _WORKER_GRAPH = graph
+
+
+def _worker_isochrones(payload):
+    return _WORKER_GRAPH.isochrones(payload['locations'], payload['range'])
+
+
+class LocalIsochroneEngine:
+    '''
+        Computes isochrones from a local street graph, as an offline
+        alternative to the OpenRouteService API.
+
+        Jobs are spread across worker processes, each of which receives a copy
+        of the graph once. Like IsochroneScheduler, the engine accepts ORS
+        request payloads and returns ORS-shaped responses, so either may be
+        used by get_isochrones_with_cache.
+
+        Parameters
+        ----------
+        graph: StreetGraph
+            The walking network.
+
+        workers: int
+            The number of processes; defaults to the number of CPUs. If 1,
+            isochrones are computed in this process.
+
+        max_locations: int
+            The most locations computed in one job. Each job's Dijkstra search
+            holds a travel time for every node per location, bounding memory use.
+        '''
+
+    max_payload_bytes = None
+
+    def __init__(self, graph, workers=None, max_locations=20):
+        self.graph = graph
+        self.workers = workers
+        self.max_locations = max_locations
+
+    def run(self, jobs, on_result):
+        '''
+            Computes every job, calling on_result(key, response) in the
+            calling process as each one completes.
+
+            Parameters
+            ----------
+            jobs: dict
+                A dictionary of job keys and ORS request payloads, each with
+                "locations" and "range".
+
+            on_result: callable
+                Called with the key and response of each finished job.
+
+
+            Returns
+            -------
+            dict
+                A dictionary of the keys of failed jobs and their exceptions.
+            '''
+        failures = {}
+
+        if self.workers == 1:
+            for key, payload in jobs.items():
+                try:
+                    result = self.graph.isochrones(payload['locations'], payload['range'])
+                except Exception as error:
+                    failures[key] = error
+                    continue
+
+                on_result(key, result)
+
+            return failures
+
+        #Pipeline stages run in threads; forking a threaded process can deadlock,
+        #so workers are started by a fork server
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.graph,),
+                                 mp_context=multiprocessing.get_context('forkserver')) as executor:
+            futures = {executor.submit(_worker_isochrones, payload): key for key, payload in jobs.items()}
+
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failures[key] = error
+                    continue
+
+                on_result(key, result)
+
+        return failures
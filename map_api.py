@@ -0,0 +1,211 @@
+#Imports
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+from map_db import DB_PATH
+
+
+#Tables joined onto the tracts table by GEOID, where they exist
+TRACT_TABLES = ['tract_access', 'tract_nearest']
+
+
+class DatabaseUnavailable(Exception):
+    '''
+        Raised when the map database, or a table a query needs, does not yet
+        exist (e.g. before data are first fetched).
+        '''
+
+
+class ConnectionPool:
+    '''
+        Up to a fixed number of read-only connections to a SQLite database,
+        shared between threads. Connections are opened when first needed, so
+        the pool may be created before the database exists.
+
+        Parameters
+        ----------
+        db_path: str
+            The path to the SQLite database.
+
+        size: int
+            The number of connections.
+        '''
+
+    def __init__(self, db_path=DB_PATH, size=4):
+        self.db_path = db_path
+        self.size = size
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.connections = queue.Queue()
+
+    def connect(self):
+        if not os.path.exists(self.db_path):
+            raise DatabaseUnavailable(f'{self.db_path} does not exist')
+
+        try:
+            conn = sqlite3.connect(f'file:{os.path.abspath(self.db_path)}?mode=ro', uri=True,
+                                   check_same_thread=False)
+        except sqlite3.OperationalError as error:
+            raise DatabaseUnavailable(str(error))
+
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self.lock:
+            open_new = self.connections.empty() and self.opened < self.size
+            if open_new:
+                self.opened += 1
+
+        if open_new:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self.lock:
+                    self.opened -= 1
+                raise
+        else:
+            conn = self.connections.get()
+
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+
+def parse_bbox(value):
+    '''
+        Parses a "min_lon,min_lat,max_lon,max_lat" string into a tuple of
+        floats rounded to six decimal places; raises ValueError if malformed.
+        '''
+    bbox = tuple(round(float(part), 6) for part in value.split(','))
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError(f'Invalid bbox: {value}')
+
+    return bbox
+
+
+class MapAPI:
+    '''
+        Answers queries for markets and tracts from the map database.
+
+        Responses are kept in an LRU cache keyed by the normalized query and
+        the state of the database files, so that they are recomputed once the
+        database is rewritten.
+
+        Parameters
+        ----------
+        db_path: str
+            The path to the SQLite database.
+
+        pool_size: int
+            The number of read-only connections.
+
+        cache_size: int
+            The number of responses cached.
+        '''
+
+    def __init__(self, db_path=DB_PATH, pool_size=4, cache_size=1024):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, size=pool_size)
+        self.cached_markets = lru_cache(maxsize=cache_size)(self.query_markets)
+        self.cached_tract = lru_cache(maxsize=cache_size)(self.query_tract)
+
+    def db_version(self):
+        versions = []
+        for path in [self.db_path, self.db_path + '-wal']:
+            try:
+                stat = os.stat(path)
+                versions.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                versions.append(None)
+
+        return tuple(versions)
+
+    def tables(self, conn):
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def markets(self, bbox=None, shops=None):
+        '''
+            Returns markets as a GeoJSON FeatureCollection.
+
+            Parameters
+            ----------
+            bbox: str
+                "min_lon,min_lat,max_lon,max_lat"; if given, only markets
+                within it are returned.
+
+            shops: str
+                Comma-separated shop types (e.g. "supermarket,greengrocer");
+                if given, only markets of these types are returned.
+
+
+            Returns
+            -------
+            dict
+
+            Raises DatabaseUnavailable if the markets have not been loaded.
+            '''
+        bbox = parse_bbox(bbox) if bbox else None
+        shops = tuple(sorted({shop.strip() for shop in shops.split(',') if shop.strip()})) if shops else None
+
+        return self.cached_markets(bbox, shops, self.db_version())
+
+    def query_markets(self, bbox, shops, version):
+        query = '''SELECT m.feat_id, m.name, m.shop, m.addr, m.GEOID, m.lon, m.lat FROM markets AS m'''
+        conditions, params = [], []
+
+        if bbox is not None:
+            query += ' JOIN markets_rtree AS r ON r.id = m.rowid'
+            conditions.append('r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ?')
+            conditions.append('m.lon BETWEEN ? AND ? AND m.lat BETWEEN ? AND ?')
+            params += [bbox[0], bbox[2], bbox[1], bbox[3]]*2
+
+        if shops is not None:
+            conditions.append(f"m.shop IN ({', '.join('?'*len(shops))})")
+            params += list(shops)
+
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        with self.pool.connection() as conn:
+            if 'markets' not in self.tables(conn) or (bbox is not None and 'markets_rtree' not in self.tables(conn)):
+                raise DatabaseUnavailable('the markets table or its spatial index has not been built')
+            rows = conn.execute(query, params).fetchall()
+
+        features = [{'type': 'Feature',
+                     'id': row['feat_id'],
+                     'geometry': {'type': 'Point', 'coordinates': [row['lon'], row['lat']]},
+                     'properties': {key: row[key] for key in ['name', 'shop', 'addr', 'GEOID']}}
+                    for row in rows]
+
+        return {'type': 'FeatureCollection', 'features': features}
+
+    def tract(self, geoid):
+        '''
+            Returns the attributes of a tract, including its access measures
+            where computed, or None if there is no such tract. Raises
+            DatabaseUnavailable if the tracts have not been loaded.
+            '''
+        return self.cached_tract(geoid.strip(), self.db_version())
+
+    def query_tract(self, geoid, version):
+        with self.pool.connection() as conn:
+            if 'tracts' not in self.tables(conn):
+                raise DatabaseUnavailable('the tracts table has not been built')
+            row = conn.execute('SELECT * FROM tracts WHERE geoid = ?', (geoid,)).fetchone()
+            if row is None:
+                return None
+
+            tract = dict(row)
+            for table in [table for table in TRACT_TABLES if table in self.tables(conn)]:
+                extra = conn.execute(f'SELECT * FROM "{table}" WHERE GEOID = ?', (geoid,)).fetchone()
+                if extra is not None:
+                    tract.update({key: extra[key] for key in extra.keys() if key != 'GEOID'})
+
+        return tract
@@ -0,0 +1,124 @@
+#Imports
+import sqlite3
+
+from instrumentation import count, timed
+
+
+DB_PATH = 'Geospatial_Data/map_data.sqlite'
+BATCH_SIZE = 10000
+
+
+def column_type(series):
+    '''
+        Infers the SQLite column type for a pandas Series: integers (including
+        floats that only hold whole numbers and NaN) become INTEGER, other
+        floats REAL, and everything else TEXT.
+        '''
+    kind = series.dtype.kind
+
+    if kind in 'iub':
+        return 'INTEGER'
+    elif kind == 'f':
+        values = series.dropna()
+        if len(values) > 0 and (values % 1 == 0).all():
+            return 'INTEGER'
+        return 'REAL'
+    else:
+        return 'TEXT'
+
+
+def iter_rows(dataframe, batch_size=BATCH_SIZE):
+    '''
+        Yields the rows of a DataFrame as lists of built-in Python values, with
+        missing values as None, converting one batch at a time.
+        '''
+    for start in range(0, dataframe.shape[0], batch_size):
+        batch = dataframe.iloc[start:start + batch_size].astype(object)
+        yield from batch.where(batch.notna(), None).values.tolist()
+
+
+def bulk_load(table_name, dataframe, primary_key=None, indexes=(), point_index=None, db_path=DB_PATH):
+    '''
+        Replaces a table in the map database with the contents of a DataFrame,
+        in a single transaction.
+
+        Column types are inferred from the DataFrame's dtypes, and column names
+        are used as given. Durability pragmas are relaxed for the length of the
+        load, and indexes are built once all rows are inserted.
+
+        Parameters
+        ----------
+        table_name: str
+            The name of the table to be replaced.
+
+        dataframe: DataFrame
+            The rows to be loaded; must not contain a geometry column.
+
+        primary_key: str
+            The column to be declared PRIMARY KEY; defaults to None.
+
+        indexes: iterable
+            Columns on which to create indexes.
+
+        point_index: tuple
+            If given, the names of x and y coordinate columns, indexed in an
+            R*Tree table "<table_name>_rtree" whose ids are table rowids.
+
+        db_path: str
+            The path to the SQLite database.
+
+
+        Returns
+        -------
+        None
+        '''
+    columns = dataframe.columns.tolist()
+
+    schema = []
+    for column in columns:
+        definition = f'"{column}" {column_type(dataframe[column])}'
+        if column == primary_key:
+            definition += ' PRIMARY KEY'
+        schema.append(definition)
+
+    schema_string = ',\n    '.join(schema)
+    create_statement = f'''CREATE TABLE "{table_name}"(
+    {schema_string})'''
+    add_statement = f'''INSERT INTO "{table_name}"
+    VALUES (?{', ?'*(len(columns)-1)})'''
+
+    #Tables may be loaded from concurrent pipeline stages; wait for the write lock
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+
+    try:
+        with timed(f'sqlite.{table_name}'):
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            conn.execute(create_statement)
+            conn.executemany(add_statement, iter_rows(dataframe))
+
+            for column in indexes:
+                conn.execute(f'''CREATE INDEX "idx_{table_name}_{column}"
+                ON "{table_name}"("{column}")''')
+
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}_rtree"')
+            if point_index is not None:
+                x_column, y_column = point_index
+                conn.execute(f'''CREATE VIRTUAL TABLE "{table_name}_rtree"
+                USING rtree(id, min_x, max_x, min_y, max_y)''')
+                conn.execute(f'''INSERT INTO "{table_name}_rtree"
+                SELECT rowid, "{x_column}", "{x_column}", "{y_column}", "{y_column}" FROM "{table_name}"
+                WHERE "{x_column}" IS NOT NULL AND "{y_column}" IS NOT NULL''')
+
+            conn.execute('COMMIT')
+    except:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA optimize')
+        conn.close()
+
+    count(f'sqlite.{table_name}.rows', dataframe.shape[0])
@@ -0,0 +1,212 @@
+#Imports
+import html
+import json
+
+import numpy as np
+import shapely
+from branca.utilities import color_brewer
+from folium.map import Layer
+from folium.plugins import MarkerCluster
+from jinja2 import Template
+
+
+def marker_rows(points, label_column='name', precision=6):
+    '''
+        Returns [latitude, longitude, label] rows for a point layer, for use
+        by MarketMarkers. Labels are HTML-escaped; missing labels are None.
+        '''
+    coords = shapely.get_coordinates(points.geometry.to_numpy()).round(precision)
+    labels = points[label_column].astype(object).where(points[label_column].notna(), None)
+
+    return [[lat, lon, None if label is None else html.escape(str(label))]
+            for (lon, lat), label in zip(coords.tolist(), labels)]
+
+
+class MarketMarkers(MarkerCluster):
+    '''
+        A cluster of market markers, built in the browser from one compact
+        array of rows rather than from a folium Marker per market.
+
+        Parameters
+        ----------
+        rows: list
+            [latitude, longitude, label] rows, as returned by marker_rows.
+            Compute them once and pass them to each map showing the markets.
+
+        name: str
+            The name of the layer in the layer control.
+        '''
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var rows = {{ this.rows|tojson }};
+                var icon = L.AwesomeMarkers.icon({prefix: 'fa', icon: 'apple',
+                                                  markerColor: 'white', iconColor: 'red'});
+                var cluster = L.markerClusterGroup();
+
+                cluster.addLayers(rows.map(function(row) {
+                    var marker = L.marker([row[0], row[1]], {icon: icon});
+                    if (row[2] !== null) {
+                        marker.bindPopup(row[2]);
+                    }
+                    return marker;
+                }));
+
+                return cluster;
+            })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, rows, name='Markets', overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'MarketMarkers'
+        self.rows = rows
+
+
+class IndicatorChoropleth(Layer):
+    '''
+        A choropleth of census tracts that embeds tract geometry once and lets
+        the viewer switch between indicators in the browser.
+
+        Each indicator's values are stored as feature properties, and its
+        colour bins are computed here; switching indicators restyles the same
+        layer rather than drawing another copy of the geometry.
+
+        Parameters
+        ----------
+        geo_data: str or dict
+            A GeoJSON FeatureCollection, or the path to one.
+
+        data: DataFrame
+            Indicator values, one row per tract.
+
+        indicators: list
+            Dictionaries with keys 'column' (a column of data), 'name' (shown
+            in the indicator control), 'fill_color' (a ColorBrewer scheme) and
+            'legend_name'.
+
+        key_on: str
+            The feature property matched against `data_key`.
+
+        data_key: str
+            The column of data holding tract identifiers.
+
+        bins: int
+            The number of equal-width colour bins per indicator.
+
+        name: str
+            The name of the layer in the layer control.
+        '''
+
+    _template = Template(
+        """
+        {% macro header(this, kwargs) %}
+            <style>
+                .indicator-control { background: white; padding: 6px 8px;
+                    font: 12px/1.4 Arial, sans-serif; border-radius: 4px;
+                    box-shadow: 0 0 6px rgba(0,0,0,0.3); }
+                .indicator-control i { display: inline-block; width: 14px;
+                    height: 10px; margin-right: 4px; opacity: 0.7; }
+            </style>
+        {% endmacro %}
+
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var indicators = {{ this.indicators|tojson }};
+                var active = indicators[0];
+
+                function colorFor(indicator, value) {
+                    if (value === null || value === undefined) {
+                        return {{ this.nan_fill_color|tojson }};
+                    }
+                    for (var i = 1; i < indicator.bins.length - 1; i++) {
+                        if (value < indicator.bins[i]) {
+                            return indicator.colors[i - 1];
+                        }
+                    }
+                    return indicator.colors[indicator.colors.length - 1];
+                }
+
+                function style(feature) {
+                    return {fillColor: colorFor(active, feature.properties[active.column]),
+                            fillOpacity: {{ this.fill_opacity }},
+                            color: 'black', weight: 1, opacity: {{ this.line_opacity }}};
+                }
+
+                var layer = L.geoJson({{ this.geo_data|tojson }}, {style: style});
+
+                var control = L.control({position: 'bottomright'});
+                control.onAdd = function() {
+                    var div = L.DomUtil.create('div', 'indicator-control');
+                    L.DomEvent.disableClickPropagation(div);
+                    return div;
+                };
+
+                function render() {
+                    var div = control.getContainer();
+                    var html = '';
+                    indicators.forEach(function(indicator, i) {
+                        html += '<label><input type="radio" name="{{ this.get_name() }}" value="' + i + '"'
+                            + (indicator === active ? ' checked' : '') + '> ' + indicator.name + '</label><br>';
+                    });
+                    html += '<b>' + active.legend_name + '</b><br>';
+                    active.colors.forEach(function(color, i) {
+                        html += '<i style="background:' + color + '"></i>'
+                            + active.bins[i].toLocaleString() + ' &ndash; '
+                            + active.bins[i + 1].toLocaleString() + '<br>';
+                    });
+                    div.innerHTML = html;
+                    div.querySelectorAll('input').forEach(function(input) {
+                        input.addEventListener('change', function() {
+                            active = indicators[parseInt(this.value)];
+                            layer.setStyle(style);
+                            render();
+                        });
+                    });
+                }
+
+                layer.on('add', function() { control.addTo(layer._map); render(); });
+                layer.on('remove', function() { control.remove(); });
+
+                return layer;
+            })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, geo_data, data, indicators, key_on='GEOID', data_key='GEOID', bins=6,
+                 fill_opacity=0.6, line_opacity=0.2, nan_fill_color='black',
+                 name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'IndicatorChoropleth'
+
+        if isinstance(geo_data, str):
+            with open(geo_data, 'r') as geo_file:
+                geo_data = json.load(geo_file)
+
+        columns = [indicator['column'] for indicator in indicators]
+        values = data.set_index(data_key)[columns].astype(float)
+        values = values.round(4).astype(object).where(values.notna(), None)
+        records = values.to_dict(orient='index')
+
+        for feature in geo_data['features']:
+            key = feature['properties'][key_on]
+            feature['properties'] = dict(records.get(key, dict.fromkeys(columns)), **{key_on: key})
+
+        self.indicators = []
+        for indicator in indicators:
+            column_values = values[indicator['column']].dropna().to_numpy(dtype=float)
+            edges = np.histogram_bin_edges(column_values, bins=bins) if len(column_values) else np.zeros(bins + 1)
+            self.indicators.append({'column': indicator['column'],
+                                    'name': indicator['name'],
+                                    'legend_name': indicator.get('legend_name', indicator['name']),
+                                    'bins': [round(float(edge), 2) for edge in edges],
+                                    'colors': color_brewer(indicator['fill_color'], n=bins)})
+
+        self.geo_data = geo_data
+        self.fill_opacity = fill_opacity
+        self.line_opacity = line_opacity
+        self.nan_fill_color = nan_fill_color
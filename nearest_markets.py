@@ -0,0 +1,167 @@
+#Imports
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+import map_db
+from layer_store import load_layer
+
+
+#UTM zone 18N, in metres, so that straight-line distances are in metres
+PROJECTED_CRS = 'epsg:32618'
+
+
+class MarketIndex:
+    '''
+        A KD-tree over market locations, answering nearest-market queries by
+        straight-line distance without calling a routing API.
+
+        Parameters
+        ----------
+        ids: array-like
+            Market identifiers.
+
+        names: array-like
+            Market names.
+
+        lons, lats: array-like
+            Market coordinates in EPSG:4326.
+        '''
+
+    def __init__(self, ids, names, lons, lats):
+        self.ids = np.asarray(ids)
+        names = pd.Series(names, dtype=object)
+        self.names = names.where(names.notna(), None).to_numpy()
+        self.transformer = Transformer.from_crs('epsg:4326', PROJECTED_CRS, always_xy=True)
+
+        x, y = self.transformer.transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+        self.tree = cKDTree(np.column_stack([x, y]))
+
+    @classmethod
+    def from_frame(cls, markets):
+        '''
+            Builds an index over a GeoDataFrame of points with "id" and "name" columns.
+            '''
+        markets = markets.to_crs('epsg:4326')
+        return cls(markets['id'].to_numpy(), markets['name'].to_numpy(),
+                   markets.geometry.x.to_numpy(), markets.geometry.y.to_numpy())
+
+    @classmethod
+    def from_layer(cls, layer_name='markets'):
+        '''
+            Builds an index over a point layer saved in Geospatial_Data.
+            '''
+        return cls.from_frame(load_layer(layer_name, columns=['id', 'name']))
+
+    def query(self, lons, lats, k=1):
+        '''
+            Finds the k nearest markets to each of an array of points.
+
+            Parameters
+            ----------
+            lons, lats: array-like
+                Point coordinates in EPSG:4326.
+
+            k: int
+                The number of markets returned per point.
+
+
+            Returns
+            -------
+            tuple
+                Arrays of distances in metres and of market positions in the
+                index, each of shape (points, k).
+            '''
+        k = min(k, len(self.ids))
+        if k == 0:
+            return np.empty((len(lons), 0)), np.empty((len(lons), 0), dtype=int)
+
+        x, y = self.transformer.transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+        distances, positions = self.tree.query(np.column_stack([x, y]), k=k)
+
+        return distances.reshape(len(x), k), positions.reshape(len(x), k)
+
+    def nearest(self, lon, lat, k=1):
+        '''
+            Returns the k nearest markets to a single point, as a list of
+            dictionaries with keys 'id', 'name' and 'distance' (in metres).
+            Fewer than k are returned if the index holds fewer markets.
+
+            Raises ValueError if the point is not a finite longitude and latitude.
+            '''
+        if not (np.isfinite(lon) and np.isfinite(lat) and -180 <= lon <= 180 and -90 <= lat <= 90):
+            raise ValueError(f'Invalid point: {lon}, {lat}')
+
+        k = min(k, len(self.ids))
+        if k == 0:
+            return []
+
+        x, y = self.transformer.transform(lon, lat)
+        distances, positions = self.tree.query((x, y), k=k)
+
+        return [{'id': self.ids[position].item(),
+                 'name': self.names[position],
+                 'distance': round(float(distance), 1)}
+                for distance, position in zip(np.atleast_1d(distances), np.atleast_1d(positions))]
+
+
+def point_grid(bounds, spacing=0.005):
+    '''
+        Returns the longitudes and latitudes of a regular grid of points
+        covering bounds (minx, miny, maxx, maxy), spaced in degrees.
+        '''
+    minx, miny, maxx, maxy = bounds
+    lons, lats = np.meshgrid(np.arange(minx, maxx + spacing, spacing),
+                             np.arange(miny, maxy + spacing, spacing))
+
+    return lons.ravel(), lats.ravel()
+
+
+def tract_nearest(tracts, index, k=3):
+    '''
+        Computes the straight-line distance from each tract's internal point
+        (INTPTLON, INTPTLAT) to its k nearest markets.
+
+        Parameters
+        ----------
+        tracts: DataFrame
+            Tracts with "GEOID", "INTPTLAT" and "INTPTLON" columns.
+
+        index: MarketIndex
+            The market index queried.
+
+        k: int
+            The number of nearest markets measured.
+
+
+        Returns
+        -------
+        DataFrame
+            One row per tract, with the id of the nearest market
+            ("nearest_id") and distances in metres ("dist_1" to "dist_<k>").
+        '''
+    lons = pd.to_numeric(tracts['INTPTLON']).to_numpy()
+    lats = pd.to_numeric(tracts['INTPTLAT']).to_numpy()
+    distances, positions = index.query(lons, lats, k=k)
+
+    nearest = pd.DataFrame({'GEOID': tracts['GEOID'].to_numpy(),
+                            'nearest_id': index.ids[positions[:, 0]]})
+    for i in range(distances.shape[1]):
+        nearest[f'dist_{i + 1}'] = distances[:, i].round(1)
+
+    return nearest
+
+
+def make_nearest_table(tracts, index=None, k=3):
+    '''
+        Writes the distances computed by tract_nearest to the "tract_nearest"
+        table of the map database, and returns them.
+        '''
+    if index is None:
+        index = MarketIndex.from_layer()
+
+    nearest = tract_nearest(tracts, index, k=k)
+    map_db.bulk_load('tract_nearest', nearest, primary_key='GEOID')
+
+    return nearest
@@ -0,0 +1,221 @@
+#Imports
+import email.utils
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from instrumentation import count, timed
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    '''
+        Rate limiter allowing a fixed number of requests per minute, with
+        bursts of up to `capacity` requests.
+
+        Parameters
+        ----------
+        requests_per_minute: float
+            The sustained number of requests allowed per minute.
+
+        capacity: int
+            The number of requests that may be issued back-to-back.
+        '''
+
+    def __init__(self, requests_per_minute, capacity=1):
+        self.rate = requests_per_minute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+            Blocks until a request may be issued, then consumes one token.
+            '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = max(self.blocked_until - now, (1 - self.tokens)/self.rate)
+
+            count('ors.throttle_seconds', wait)
+            time.sleep(wait)
+
+    def block(self, seconds):
+        '''
+            Stops all requests for the number of seconds provided, e.g. when the
+            server responds with a Retry-After header.
+            '''
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+def parse_retry_after(value):
+    '''
+        Converts a Retry-After header, given either in seconds or as an HTTP date,
+        into a number of seconds; returns None if the header is absent or invalid.
+        '''
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class IsochroneScheduler:
+    '''
+        Issues isochrone requests concurrently within a requests-per-minute budget.
+
+        Requests answered with 429 or a 5xx status are retried after the delay
+        given in the Retry-After header or, failing that, after an exponential
+        backoff bounded by `max_backoff`.
+
+        Parameters
+        ----------
+        url: str
+            The isochrones endpoint.
+
+        headers: dict
+            Headers sent with every request.
+
+        requests_per_minute: float
+            The request budget, shared by all workers.
+
+        max_in_flight: int
+            The number of requests that may be outstanding at once.
+
+        max_retries: int
+            The number of times a single request is retried before giving up.
+
+        max_backoff: float
+            The longest delay, in seconds, between retries.
+
+        post: callable
+            The function used to issue requests; defaults to requests.post.
+
+        max_locations: int
+            The most locations the endpoint accepts in one request (5 for
+            OpenRouteService isochrones).
+
+        max_payload_bytes: int
+            The largest encoded size of one request's locations, if limited.
+        '''
+
+    def __init__(self, url, headers, requests_per_minute=20, max_in_flight=4,
+                 max_retries=5, max_backoff=60, timeout=60, post=requests.post,
+                 max_locations=5, max_payload_bytes=None):
+        self.url = url
+        self.max_locations = max_locations
+        self.max_payload_bytes = max_payload_bytes
+        self.headers = headers
+        self.bucket = TokenBucket(requests_per_minute, capacity=max_in_flight)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.post = post
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, 2**attempt))
+
+    def fetch(self, payload):
+        '''
+            Posts one payload, retrying as needed; returns the decoded JSON response.
+            '''
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+
+            count('ors.requests')
+            if attempt > 0:
+                count('ors.retries')
+
+            try:
+                with timed('http.ors'):
+                    response = self.post(self.url, json=payload, headers=self.headers, timeout=self.timeout)
+            except requests.RequestException:
+                count('ors.errors')
+                if attempt == self.max_retries:
+                    raise
+                wait = self.backoff(attempt)
+                count('ors.backoff_seconds', wait)
+                time.sleep(wait)
+                continue
+
+            count(f'ors.status_{response.status_code}')
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                wait = parse_retry_after(response.headers.get('Retry-After'))
+                if wait is None:
+                    wait = self.backoff(attempt)
+                else:
+                    wait = min(wait, self.max_backoff)
+
+                if response.status_code == 429:
+                    #Waited out in the bucket, and counted as throttling
+                    self.bucket.block(wait)
+                    print(f"Rate limited; waiting {wait:.1f} seconds...")
+                else:
+                    count('ors.backoff_seconds', wait)
+                    time.sleep(wait)
+                continue
+
+            response.raise_for_status()
+            return response.json()
+
+    def run(self, jobs, on_result):
+        '''
+            Fetches every job, calling on_result(key, response) in the calling
+            thread as each one completes.
+
+            Parameters
+            ----------
+            jobs: dict
+                A dictionary of job keys and request payloads.
+
+            on_result: callable
+                Called with the key and decoded response of each finished job.
+
+
+            Returns
+            -------
+            dict
+                A dictionary of the keys of failed jobs and their exceptions.
+            '''
+        failures = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            futures = {executor.submit(self.fetch, payload): key for key, payload in jobs.items()}
+
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failures[key] = error
+                    continue
+
+                on_result(key, result)
+
+        return failures
@@ -0,0 +1,106 @@
+#Imports
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubORSServer:
+    '''
+        A local stand-in for the OpenRouteService isochrones endpoint, for
+        checking IsochroneScheduler against rate limits and server errors
+        without an API key.
+
+        Requests are told apart by their first location. The responses
+        scripted for a location are returned in turn, each as a (status,
+        headers) pair; once they run out, requests succeed with one square
+        isochrone per location and range.
+
+        Parameters
+        ----------
+        script: dict
+            Lists of (status, headers) pairs, keyed by (lon, lat) of the
+            first location of a request.
+
+        Use as a context manager; while open, `url` is the endpoint and
+        `requests` lists the (time, first location, status) of each request.
+        '''
+
+    def __init__(self, script=None):
+        self.script = {tuple(location): list(responses) for location, responses in (script or {}).items()}
+        self.requests = []
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                status, headers = stub.respond(payload)
+
+                body = b'{}'
+                if status == 200:
+                    body = json.dumps(stub.isochrones(payload)).encode()
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/v2/isochrones/foot-walking'
+
+    def respond(self, payload):
+        key = tuple(payload['locations'][0])
+        with self.lock:
+            responses = self.script.get(key)
+            status, headers = responses.pop(0) if responses else (200, {})
+            self.requests.append((time.monotonic(), key, status))
+
+        return status, headers
+
+    def isochrones(self, payload):
+        features = []
+        for group_index, (lon, lat) in enumerate(payload['locations']):
+            for value in payload['range']:
+                size = value / 100000
+                ring = [[lon - size, lat - size], [lon + size, lat - size], [lon + size, lat + size],
+                        [lon - size, lat + size], [lon - size, lat - size]]
+                features.append({'type': 'Feature',
+                                 'properties': {'group_index': group_index, 'value': float(value),
+                                                'center': [lon, lat]},
+                                 'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+
+        return {'type': 'FeatureCollection', 'features': features}
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    #Serve until interrupted, answering every third request with a 429
+    class RateLimitedServer(StubORSServer):
+        def respond(self, payload):
+            with self.lock:
+                limited = len(self.requests) % 3 == 2
+                self.requests.append((time.monotonic(), tuple(payload['locations'][0]), 429 if limited else 200))
+            return (429, {'Retry-After': '2'}) if limited else (200, {})
+
+    with RateLimitedServer() as stub:
+        print(f"Stub ORS endpoint at {stub.url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,86 @@
+#Imports
+import json
+from array import array
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def iter_elements(stream):
+    '''
+        Yields the elements of an Overpass JSON response one at a time.
+
+        Elements are read incrementally with ijson where it is installed;
+        otherwise the response is decoded in full.
+
+        Parameters
+        ----------
+        stream: file
+            A binary file object holding an Overpass JSON response.
+        '''
+    if ijson is not None:
+        yield from ijson.items(stream, 'elements.item', use_float=True)
+    else:
+        yield from json.load(stream)['elements']
+
+
+def parse_points(stream, tags):
+    '''
+        Parses the tagged elements of an Overpass response into a point
+        GeoDataFrame, without building an intermediate FeatureCollection.
+
+        Nodes are located at their coordinates, and ways and relations at
+        their centers; untagged elements are skipped.
+
+        Parameters
+        ----------
+        stream: file
+            A binary file object holding an Overpass JSON response.
+
+        tags: list
+            The tags to be kept as columns.
+
+
+        Returns
+        -------
+        GeoDataFrame
+            One row per tagged element, with an "id" column, a column per tag
+            and point geometries in EPSG:4326.
+        '''
+    ids = array('q')
+    lons = array('d')
+    lats = array('d')
+    columns = {tag: [] for tag in tags}
+
+    for element in iter_elements(stream):
+        if 'tags' not in element:
+            continue
+
+        if element['type'] == 'node':
+            location = element
+        elif 'center' in element:
+            location = element['center']
+        else:
+            continue
+
+        ids.append(element['id'])
+        lons.append(location['lon'])
+        lats.append(location['lat'])
+
+        element_tags = element['tags']
+        for tag in tags:
+            columns[tag].append(element_tags.get(tag))
+
+    data = {'id': np.frombuffer(ids, dtype=np.int64)}
+    for tag in tags:
+        data[tag] = pd.array(columns[tag], dtype='string')
+
+    geometry = gpd.points_from_xy(np.frombuffer(lons), np.frombuffer(lats))
+
+    return gpd.GeoDataFrame(data, geometry=geometry, crs='epsg:4326')
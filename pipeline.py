@@ -0,0 +1,223 @@
+#Imports
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from instrumentation import RECORDER, measure, profile_path
+
+
+MANIFEST_PATH = './Cache/pipeline_manifest.json'
+
+
+def file_fingerprint(path):
+    '''
+        Returns a hash of a file's contents, or None if it does not exist.
+        '''
+    if not os.path.exists(path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class Stage:
+    '''
+        A step of a pipeline.
+
+        Parameters
+        ----------
+        name: str
+            The name of the stage.
+
+        func: callable
+            Called with the results of the stages in deps, in order.
+
+        deps: iterable
+            The names of stages that must finish first.
+
+        inputs: iterable
+            Files read by the stage. If none of them have changed since the
+            stage last ran, and every file in outputs exists, the stage is
+            skipped.
+
+        outputs: iterable
+            Files written by the stage.
+
+        load: callable
+            Called instead of func when the stage is skipped, to provide its
+            result to later stages; if not given, a skipped stage's result is None.
+
+        executor: str
+            'thread' or 'process'. Stages run in a process must have picklable
+            arguments, results and functions.
+
+        version: int
+            The version of what the stage writes (e.g. a table schema). It is
+            recorded with the stage's inputs, so that changing it re-runs the
+            stage even if its inputs are unchanged.
+        '''
+
+    def __init__(self, name, func, deps=(), inputs=(), outputs=(), load=None, executor='thread',
+                 version=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.load = load
+        self.executor = executor
+        self.version = version
+
+
+class Pipeline:
+    '''
+        Runs a set of stages, starting each as soon as the stages it depends
+        on have finished, so that independent stages run concurrently.
+
+        Parameters
+        ----------
+        stages: list
+            The stages of the pipeline.
+
+        manifest_path: str
+            The JSON file recording the inputs each stage last ran with.
+
+        max_workers: int
+            The number of stages that may run at once in each of the thread
+            and process pools.
+        '''
+
+    def __init__(self, stages, manifest_path=MANIFEST_PATH, max_workers=4):
+        self.stages = {stage.name: stage for stage in stages}
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f'Stage {stage.name} depends on unknown stage {dep}')
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+
+    def write_manifest(self, manifest):
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+    def fingerprint(self, stage):
+        fingerprint = {path: file_fingerprint(path) for path in stage.inputs}
+        if stage.version is not None:
+            fingerprint['version'] = stage.version
+
+        return fingerprint
+
+    def is_current(self, stage, manifest):
+        return (len(stage.inputs) > 0
+                and manifest.get(stage.name) == self.fingerprint(stage)
+                and all(os.path.exists(path) for path in stage.outputs))
+
+    def run(self, force=(), profile=()):
+        '''
+            Runs the pipeline.
+
+            Parameters
+            ----------
+            force: iterable
+                Names of stages to run even if their inputs are unchanged.
+
+            profile: iterable
+                Names of stages to run under cProfile; the statistics of each
+                are written to instrumentation.profile_path(name).
+
+
+            Returns
+            -------
+            dict
+                The result of each stage, keyed by name. Per-stage timings
+                are printed and kept in self.report, and each stage's time
+                and peak memory are recorded in instrumentation.RECORDER.
+            '''
+        force, profile = set(force), set(profile)
+        unknown = (force | profile) - self.stages.keys()
+        if unknown:
+            raise ValueError(f'Unknown stages: {sorted(unknown)}')
+
+        manifest = self.read_manifest()
+        results = {}
+        self.report = {}
+
+        pending = dict(self.stages)
+        running = {}
+        error = None
+        start = time.perf_counter()
+
+        pools = {'thread': ThreadPoolExecutor(max_workers=self.max_workers)}
+        if any(stage.executor == 'process' for stage in self.stages.values()):
+            pools['process'] = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        try:
+            while pending or running:
+                if error is None:
+                    ready = [stage for stage in pending.values() if all(dep in results for dep in stage.deps)]
+                    for stage in ready:
+                        del pending[stage.name]
+
+                        if stage.name not in force and self.is_current(stage, manifest):
+                            func, args, status = stage.load or (lambda: None), (), 'skipped'
+                        else:
+                            func, args, status = stage.func, [results[dep] for dep in stage.deps], 'ran'
+
+                        pool = pools['thread'] if status == 'skipped' else pools[stage.executor]
+                        path = profile_path(stage.name) if stage.name in profile else None
+                        running[pool.submit(measure, func, *args, profile_path=path)] = (stage, status)
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, status = running.pop(future)
+                    try:
+                        results[stage.name], measurements = future.result()
+                    except Exception as stage_error:
+                        print(f"Stage {stage.name} failed: {stage_error!r}")
+                        RECORDER.set_stage(stage.name, {'status': 'failed', 'error': repr(stage_error)})
+                        error = error or stage_error
+
+                        #A failed stage is never current, so the next run retries it
+                        if manifest.pop(stage.name, None) is not None:
+                            self.write_manifest(manifest)
+                        continue
+
+                    self.report[stage.name] = dict(measurements, status=status)
+                    RECORDER.set_stage(stage.name, self.report[stage.name])
+                    print(f"Stage {stage.name} {status} in {measurements['seconds']:.1f} seconds")
+
+                    if status == 'ran' and stage.inputs:
+                        manifest[stage.name] = self.fingerprint(stage)
+                        self.write_manifest(manifest)
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+
+        if error is not None:
+            raise error
+        if pending:
+            raise ValueError(f'Stages {sorted(pending)} could not run; their dependencies form a cycle')
+
+        total = time.perf_counter() - start
+        stage_total = sum(entry['seconds'] for entry in self.report.values())
+        print(f"Pipeline finished in {total:.1f} seconds ({stage_total:.1f} seconds of stage time)")
+
+        return results
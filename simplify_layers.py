@@ -0,0 +1,124 @@
+#Imports
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+import shapely
+
+
+SIMPLIFIED_DIR = 'Geospatial_Data/simplified'
+
+#Tolerance in degrees, and decimal places kept in coordinates, per level of detail
+LEVELS = {'low': {'tolerance': 0.001, 'precision': 4},
+          'medium': {'tolerance': 0.0003, 'precision': 5},
+          'high': {'tolerance': 0.0001, 'precision': 5}}
+
+
+def geometry_hash(geodataframe, columns=()):
+    '''
+        Returns a hash of a layer's geometries and the columns provided.
+        '''
+    digest = hashlib.sha256()
+    for wkb in shapely.to_wkb(geodataframe.geometry.to_numpy()):
+        digest.update(wkb)
+    for column in columns:
+        digest.update(geodataframe[column].astype(str).str.cat(sep='\x1f').encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def simplify_geometries(geometries, tolerance, precision, coverage=False):
+    '''
+        Simplifies an array of geometries and rounds their coordinates.
+
+        Parameters
+        ----------
+        geometries: ndarray
+            The geometries to be simplified.
+
+        tolerance: float
+            The largest distance, in the geometries' units, by which a
+            simplified edge may depart from the original.
+
+        precision: int
+            The number of decimal places kept in coordinates.
+
+        coverage: bool
+            If True, the geometries are treated as a non-overlapping coverage
+            (e.g. census tracts) and simplified so that shared borders stay
+            shared, without gaps or overlaps.
+
+
+        Returns
+        -------
+        ndarray
+        '''
+    if coverage:
+        simplified = shapely.coverage_simplify(geometries, tolerance)
+    else:
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+    #Snapping to a grid moves vertices shared by neighbours to the same point
+    return shapely.set_precision(simplified, 10**-precision)
+
+
+def simplified_layer(geodataframe, layer_name, level='medium', columns=(), coverage=False,
+                     out_dir=SIMPLIFIED_DIR):
+    '''
+        Returns the path to a simplified GeoJSON copy of a layer at the level
+        of detail requested.
+
+        Copies at every level in LEVELS are written to out_dir together, and
+        are rebuilt only when the layer's geometries or kept columns change.
+
+        Parameters
+        ----------
+        geodataframe: GeoDataFrame
+            The layer to be simplified, in EPSG:4326 or another degree-based CRS.
+
+        layer_name: str
+            The name under which simplified copies are saved.
+
+        level: str
+            One of 'low', 'medium' or 'high'.
+
+        columns: iterable
+            The attribute columns kept in the simplified copies.
+
+        coverage: bool
+            If True, the layer is simplified as a coverage; see simplify_geometries.
+
+
+        Returns
+        -------
+        str
+        '''
+    os.makedirs(out_dir, exist_ok=True)
+
+    columns = list(columns)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    paths = {name: os.path.join(out_dir, f'{layer_name}_{name}.geojson') for name in LEVELS}
+
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        manifest = {}
+
+    source_hash = geometry_hash(geodataframe, columns)
+    if manifest.get(layer_name) == source_hash and all(os.path.exists(path) for path in paths.values()):
+        return paths[level]
+
+    geometries = geodataframe.geometry.to_numpy()
+    for name, settings in LEVELS.items():
+        simplified = gpd.GeoDataFrame(geodataframe[columns].reset_index(drop=True),
+                                      geometry=simplify_geometries(geometries, coverage=coverage, **settings),
+                                      crs=geodataframe.crs)
+        simplified.to_file(paths[name], driver='GeoJSON', COORDINATE_PRECISION=settings['precision'])
+
+    manifest[layer_name] = source_hash
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return paths[level]
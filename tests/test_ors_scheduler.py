@@ -0,0 +1,61 @@
+#Imports
+import requests
+
+from instrumentation import RECORDER
+from ors_scheduler import IsochroneScheduler
+from ors_stub import StubORSServer
+
+
+RATE_LIMITED = (-73.9, 40.7)
+UNAVAILABLE = (-73.8, 40.6)
+DOWN = (-73.7, 40.5)
+HEALTHY = (-73.6, 40.4)
+
+
+def make_jobs(*locations):
+    return {location: {'locations': [list(location)], 'range': [600, 420, 300]} for location in locations}
+
+
+def test_scheduler_retries_rate_limits_and_server_errors():
+    script = {RATE_LIMITED: [(429, {'Retry-After': '1'})],
+              UNAVAILABLE: [(503, {})],
+              DOWN: [(503, {})]*3}
+
+    RECORDER.reset()
+    results = {}
+    with StubORSServer(script) as stub:
+        scheduler = IsochroneScheduler(stub.url, {}, requests_per_minute=6000, max_in_flight=2,
+                                       max_retries=2, max_backoff=5, timeout=5)
+        scheduler.backoff = lambda attempt: 0.05
+        failures = scheduler.run(make_jobs(RATE_LIMITED, UNAVAILABLE, DOWN, HEALTHY),
+                                 lambda key, response: results.__setitem__(key, response))
+
+    attempts = {}
+    for when, key, status in stub.requests:
+        attempts.setdefault(key, []).append((when, status))
+
+    #A 429 is retried once its Retry-After has passed, and then succeeds
+    assert [status for _, status in attempts[RATE_LIMITED]] == [429, 200]
+    assert attempts[RATE_LIMITED][1][0] - attempts[RATE_LIMITED][0][0] >= 0.95
+
+    #A 503 is retried after a backoff
+    assert [status for _, status in attempts[UNAVAILABLE]] == [503, 200]
+
+    #A request failing on every attempt is given up after max_retries and reported
+    assert [status for _, status in attempts[DOWN]] == [503]*3
+    assert list(failures) == [DOWN]
+    assert isinstance(failures[DOWN], requests.HTTPError)
+    assert failures[DOWN].response.status_code == 503
+
+    assert sorted(results) == sorted([RATE_LIMITED, UNAVAILABLE, HEALTHY])
+    assert len(results[HEALTHY]['features']) == 3
+
+    counters = RECORDER.report()['counters']
+    assert counters['ors.requests'] == 8
+    assert counters['ors.retries'] == 4
+    assert counters['ors.status_429'] == 1
+    #Every response is counted, including the last of a request that failed
+    assert counters['ors.status_503'] == 4
+    assert counters['ors.status_200'] == 3
+    assert counters['ors.throttle_seconds'] >= 0.9
+    assert abs(counters['ors.backoff_seconds'] - 0.15) < 1e-9
@@ -0,0 +1,272 @@
+#Imports
+import gzip
+import math
+import os
+import sqlite3
+import sys
+import threading
+from functools import lru_cache
+
+import geopandas as gpd
+import shapely
+
+from isochrone_unions import UNIONS_PATH
+from layer_store import ACS_COLUMNS, DATA_DIR, load_layer
+
+try:
+    import mapbox_vector_tile
+except ImportError:
+    mapbox_vector_tile = None
+
+
+TILES_DIR = f'{DATA_DIR}/tiles'
+
+#Tiles are served for zoom levels 0 to MAX_ZOOM
+MAX_ZOOM = 22
+EXTENT = 4096
+BUFFER = 64
+HALF_WORLD = math.pi*6378137
+
+
+def load_markets():
+    return load_layer('markets', columns=['id', 'name', 'shop'])
+
+
+def load_isochrone_bands():
+    unions = gpd.read_parquet(UNIONS_PATH, columns=['layer', 'kind', 'seconds', 'geometry'])
+    return unions[unions['kind'] == 'band'].drop(columns=['kind'])
+
+
+def load_tracts():
+    return load_layer('Tracts_with_Data', columns=['GEOID'] + ACS_COLUMNS + ['pct_nonwhite'])
+
+
+#Layers served as tiles, and the functions loading them
+TILE_LAYERS = {'markets': load_markets,
+               'isochrones': load_isochrone_bands,
+               'tracts': load_tracts}
+
+
+def tile_bounds(z, x, y):
+    '''
+        Returns the Web Mercator bounds (minx, miny, maxx, maxy) of a tile.
+        '''
+    size = 2*HALF_WORLD / 2**z
+    minx = -HALF_WORLD + x*size
+    maxy = HALF_WORLD - y*size
+
+    return minx, maxy - size, minx + size, maxy
+
+
+def mercator_to_lonlat(x, y):
+    lon = math.degrees(x/6378137)
+    lat = math.degrees(2*math.atan(math.exp(y/6378137)) - math.pi/2)
+    return lon, lat
+
+
+def tiles_covering(bounds, z):
+    '''
+        Yields the (x, y) of every tile at zoom z intersecting Web Mercator bounds.
+        '''
+    size = 2*HALF_WORLD / 2**z
+    last = 2**z - 1
+    minx, miny, maxx, maxy = bounds
+
+    x_range = range(max(0, int((minx + HALF_WORLD) // size)), min(last, int((maxx + HALF_WORLD) // size)) + 1)
+    y_range = range(max(0, int((HALF_WORLD - maxy) // size)), min(last, int((HALF_WORLD - miny) // size)) + 1)
+
+    for x in x_range:
+        for y in y_range:
+            yield x, y
+
+
+class TileLayer:
+    '''
+        A layer projected to Web Mercator and indexed for clipping into tiles.
+
+        Parameters
+        ----------
+        geodataframe: GeoDataFrame
+            The features of the layer; every non-geometry column is encoded
+            as a feature property.
+        '''
+
+    def __init__(self, geodataframe):
+        projected = geodataframe.to_crs('epsg:3857')
+
+        self.geometries = projected.geometry.to_numpy()
+        self.tree = shapely.STRtree(self.geometries)
+        self.bounds = tuple(projected.total_bounds)
+
+        properties = projected.drop(columns=projected.geometry.name)
+        properties = properties.astype(object).where(properties.notna(), None)
+        self.properties = [{key: value for key, value in record.items() if value is not None}
+                           for record in properties.to_dict(orient='records')]
+
+    def encode(self, name, z, x, y):
+        '''
+            Returns the features of the layer within a tile, encoded as an
+            uncompressed Mapbox Vector Tile.
+            '''
+        if mapbox_vector_tile is None:
+            raise RuntimeError('mapbox_vector_tile must be installed to generate tiles')
+
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        scale = EXTENT / (maxx - minx)
+        margin = BUFFER / scale
+
+        idx = self.tree.query(shapely.box(minx - margin, miny - margin, maxx + margin, maxy + margin))
+        idx.sort()
+
+        clipped = shapely.clip_by_rect(self.geometries[idx], minx - margin, miny - margin,
+                                       maxx + margin, maxy + margin)
+
+        #Tile coordinates run from 0 to EXTENT, with y increasing upward
+        local = shapely.transform(clipped, lambda coords: (coords - [minx, miny])*scale)
+        local = shapely.simplify(local, 0.5, preserve_topology=True)
+
+        features = [{'geometry': geometry, 'properties': self.properties[i]}
+                    for i, geometry in zip(idx, local) if not geometry.is_empty]
+
+        return mapbox_vector_tile.encode({'name': name, 'features': features},
+                                         default_options={'extents': EXTENT})
+
+
+class TileSource:
+    '''
+        Serves gzip-compressed vector tiles for the layers in TILE_LAYERS.
+
+        Tiles are read from the layer's MBTiles file in tiles_dir where one
+        exists and holds the tile; otherwise they are generated on demand and
+        kept in an LRU cache.
+
+        Parameters
+        ----------
+        tiles_dir: str
+            The directory holding pre-generated MBTiles files.
+
+        cache_size: int
+            The number of generated tiles kept in memory.
+        '''
+
+    def __init__(self, tiles_dir=TILES_DIR, cache_size=4096):
+        self.tiles_dir = tiles_dir
+        self.layers = {}
+        self.connections = {}
+        self.lock = threading.Lock()
+        #Each layer is loaded under its own lock, so that a cold load blocks
+        #only requests for that layer, not stored tiles or other layers
+        self.layer_locks = {name: threading.Lock() for name in TILE_LAYERS}
+        self.render = lru_cache(maxsize=cache_size)(self.render_tile)
+
+    def layer(self, name):
+        layer = self.layers.get(name)
+        if layer is None:
+            with self.layer_locks[name]:
+                if name not in self.layers:
+                    self.layers[name] = TileLayer(TILE_LAYERS[name]())
+                layer = self.layers[name]
+
+        return layer
+
+    def render_tile(self, name, z, x, y):
+        return gzip.compress(self.layer(name).encode(name, z, x, y))
+
+    def stored_tile(self, name, z, x, y):
+        path = os.path.join(self.tiles_dir, f'{name}.mbtiles')
+
+        with self.lock:
+            if name not in self.connections:
+                if not os.path.exists(path):
+                    return None
+                self.connections[name] = sqlite3.connect(f'file:{path}?mode=ro', uri=True,
+                                                         check_same_thread=False)
+
+            row = self.connections[name].execute('''SELECT tile_data FROM tiles
+            WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?''', (z, x, 2**z - 1 - y)).fetchone()
+
+        return None if row is None else row[0]
+
+    def get(self, name, z, x, y):
+        '''
+            Returns a gzip-compressed tile; raises KeyError for unknown layers.
+            '''
+        if name not in TILE_LAYERS:
+            raise KeyError(name)
+
+        tile = self.stored_tile(name, z, x, y)
+        if tile is None:
+            tile = self.render(name, z, x, y)
+
+        return tile
+
+
+def write_mbtiles(name, zooms, tiles_dir=TILES_DIR):
+    '''
+        Pre-generates the tiles of a layer at the zoom levels provided into
+        an MBTiles file, skipping tiles without features.
+
+        Parameters
+        ----------
+        name: str
+            A layer in TILE_LAYERS.
+
+        zooms: iterable
+            The zoom levels to generate.
+
+        tiles_dir: str
+            The directory in which "<name>.mbtiles" is written.
+
+
+        Returns
+        -------
+        int
+            The number of tiles written.
+        '''
+    os.makedirs(tiles_dir, exist_ok=True)
+    path = os.path.join(tiles_dir, f'{name}.mbtiles')
+    layer = TileLayer(TILE_LAYERS[name]())
+    zooms = list(zooms)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+    conn.execute('''CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,
+    tile_row INTEGER, tile_data BLOB)''')
+
+    count = 0
+    with conn:
+        for z in zooms:
+            rows = []
+            for x, y in tiles_covering(layer.bounds, z):
+                minx, miny, maxx, maxy = tile_bounds(z, x, y)
+                if len(layer.tree.query(shapely.box(minx, miny, maxx, maxy))) == 0:
+                    continue
+                rows.append((z, x, 2**z - 1 - y, gzip.compress(layer.encode(name, z, x, y))))
+
+            conn.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', rows)
+            count += len(rows)
+
+        min_lon, min_lat = mercator_to_lonlat(*layer.bounds[:2])
+        max_lon, max_lat = mercator_to_lonlat(*layer.bounds[2:])
+        conn.executemany('INSERT INTO metadata VALUES (?, ?)',
+                         [('name', name), ('format', 'pbf'),
+                          ('minzoom', str(min(zooms))), ('maxzoom', str(max(zooms))),
+                          ('bounds', f'{min_lon},{min_lat},{max_lon},{max_lat}')])
+        conn.execute('''CREATE UNIQUE INDEX tile_index
+        ON tiles (zoom_level, tile_column, tile_row)''')
+
+    conn.close()
+    return count
+
+
+if __name__ == '__main__':
+    #Usage: python tiles.py [min_zoom] [max_zoom]
+    min_zoom = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    max_zoom = int(sys.argv[2]) if len(sys.argv) > 2 else 14
+
+    for layer_name in TILE_LAYERS:
+        print(f"Wrote {write_mbtiles(layer_name, range(min_zoom, max_zoom + 1))} tiles: {layer_name}")
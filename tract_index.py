@@ -0,0 +1,129 @@
+#Imports
+import os
+import pickle
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+
+TRACTS_PATH = 'Geospatial_Data/NYC_Tracts.geojson'
+
+
+class TractIndex:
+    '''
+        Assigns points to the census tracts containing them, using an STRtree
+        over prepared tract polygons.
+
+        Parameters
+        ----------
+        geoids: array-like
+            The GEOID of each tract.
+
+        geometries: array-like
+            The polygon of each tract, in the CRS given.
+
+        crs: str
+            The CRS of the tract polygons.
+        '''
+
+    def __init__(self, geoids, geometries, crs='epsg:4326'):
+        self.geoids = np.asarray(geoids, dtype=object)
+        self.geometries = np.asarray(geometries, dtype=object)
+        self.crs = crs
+
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    @classmethod
+    def from_file(cls, tracts_path=TRACTS_PATH, index_path=None, crs='epsg:4326'):
+        '''
+            Loads the index saved alongside a tract layer, building and saving it
+            first if it is missing or older than the layer.
+
+            Parameters
+            ----------
+            tracts_path: str
+                The path to the tract layer.
+
+            index_path: str
+                The path of the saved index; defaults to the tract layer's path
+                with the extension ".index.pkl".
+
+            crs: str
+                The CRS in which points will be supplied.
+
+
+            Returns
+            -------
+            TractIndex
+            '''
+        if index_path is None:
+            index_path = os.path.splitext(tracts_path)[0] + '.index.pkl'
+
+        source_stat = os.stat(tracts_path)
+        signature = [source_stat.st_mtime_ns, source_stat.st_size, crs]
+
+        try:
+            with open(index_path, 'rb') as index_file:
+                saved = pickle.load(index_file)
+            if saved['signature'] == signature:
+                return cls(saved['geoids'], saved['geometries'], crs)
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+
+        tracts = gpd.read_file(tracts_path, columns=['GEOID']).to_crs(crs)
+        index = cls(tracts['GEOID'].to_numpy(), tracts.geometry.to_numpy(), crs)
+
+        with open(index_path, 'wb') as index_file:
+            pickle.dump({'signature': signature,
+                         'geoids': index.geoids,
+                         'geometries': index.geometries}, index_file)
+
+        return index
+
+    def assign(self, points):
+        '''
+            Returns the GEOID of the tract intersecting each point, or None for
+            points outside every tract. Points on a shared border are assigned
+            to a single tract.
+
+            Parameters
+            ----------
+            points: array-like
+                Shapely points, in the index's CRS.
+
+
+            Returns
+            -------
+            ndarray
+                An array of GEOIDs, aligned with the points.
+            '''
+        points = np.asarray(points, dtype=object)
+        result = np.full(len(points), None, dtype=object)
+
+        point_idx, tract_idx = self.tree.query(points)
+        hits = shapely.intersects_xy(self.geometries[tract_idx],
+                                     shapely.get_x(points[point_idx]),
+                                     shapely.get_y(points[point_idx]))
+        point_idx, tract_idx = point_idx[hits], tract_idx[hits]
+
+        #Keep the first tract found for each point
+        first = np.unique(point_idx, return_index=True)[1]
+        result[point_idx[first]] = self.geoids[tract_idx[first]]
+
+        return result
+
+    def assign_frame(self, geodataframe, column='GEOID'):
+        '''
+            Returns a copy of a point GeoDataFrame with the GEOID of each
+            point's tract added as a column.
+            '''
+        points = geodataframe.geometry
+        if points.crs is not None and not points.crs.equals(self.crs):
+            points = points.to_crs(self.crs)
+
+        assigned = geodataframe.copy()
+        assigned[column] = self.assign(points.to_numpy())
+
+        return assigned
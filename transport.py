@@ -0,0 +1,187 @@
+#Imports
+import hashlib
+import json
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HTTPTransport:
+    '''
+        Issues HTTP requests through a pooled, keep-alive session.
+
+        Parameters
+        ----------
+        timeout: float or tuple
+            The default (connect, read) timeout, in seconds.
+
+        max_hosts: int
+            The number of hosts for which connection pools are kept open.
+
+        max_per_host: int
+            The number of connections kept open to, and used concurrently
+            against, any one host; further requests wait for a free connection.
+        '''
+
+    def __init__(self, timeout=(10, 120), max_hosts=10, max_per_host=4):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+        adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_per_host, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=None):
+        return self.session.request(method, url, params=params, json=json, headers=headers,
+                                    timeout=self.timeout if timeout is None else timeout)
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        return self.request('GET', url, params=params, headers=headers, timeout=timeout)
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        return self.request('POST', url, json=json, headers=headers, timeout=timeout)
+
+    def download(self, url, path, params=None, chunk_size=1 << 16):
+        '''
+            Streams the body of a GET request to a file, without holding it in memory.
+            '''
+        with self.session.get(url, params=params, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as out_file:
+                for chunk in response.iter_content(chunk_size):
+                    out_file.write(chunk)
+
+    def close(self):
+        self.session.close()
+
+
+def read_fixture(path):
+    with open(path, 'r') as fixture_file:
+        return json.load(fixture_file)
+
+
+def write_fixture(path, fixture):
+    with open(path, 'w') as fixture_file:
+        json.dump(fixture, fixture_file)
+
+
+class FixtureResponse:
+    '''
+        A stored response, exposing the parts of requests.Response used by this project.
+        '''
+
+    def __init__(self, url, status_code, headers, text):
+        self.url = url
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.text = text
+        self.content = text.encode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error for url: {self.url}', response=self)
+
+
+class ReplayTransport:
+    '''
+        Serves responses from fixture files instead of the network, so the
+        pipeline can run offline and with deterministic timing.
+
+        Each fixture is a JSON file named for a hash of the request method, URL,
+        parameters and body. If a fixture is missing and a `record` transport is
+        provided, the request is passed on to it and the response saved as a
+        new fixture; otherwise a FileNotFoundError is raised.
+
+        Parameters
+        ----------
+        fixture_dir: str
+            The directory holding fixture files.
+
+        record: HTTPTransport
+            A transport used to fetch and record missing fixtures; defaults to None.
+
+        latency: float
+            A fixed delay, in seconds, added to every replayed response.
+        '''
+
+    def __init__(self, fixture_dir, record=None, latency=0):
+        self.fixture_dir = fixture_dir
+        self.record = record
+        self.latency = latency
+        os.makedirs(fixture_dir, exist_ok=True)
+
+    def fixture_path(self, method, url, params, json_body):
+        if isinstance(params, dict):
+            #API keys are left out so that fixtures can be shared
+            params = {k: v for k, v in params.items() if k != 'key'}
+        request_string = json.dumps([method, url, params, json_body], sort_keys=True, default=str)
+        key = hashlib.sha1(request_string.encode('utf-8')).hexdigest()
+        return os.path.join(self.fixture_dir, f'{key}.json')
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=None):
+        path = self.fixture_path(method, url, params, json)
+
+        if os.path.exists(path):
+            fixture = read_fixture(path)
+            if self.latency:
+                time.sleep(self.latency)
+            return FixtureResponse(url, fixture['status_code'], fixture['headers'], fixture['text'])
+
+        if self.record is None:
+            raise FileNotFoundError(f'No fixture for {method} {url} ({path})')
+
+        response = self.record.request(method, url, params=params, json=json,
+                                       headers=headers, timeout=timeout)
+        fixture = {'method': method,
+                   'url': url,
+                   'status_code': response.status_code,
+                   'headers': {'Content-Type': response.headers.get('Content-Type', '')},
+                   'text': response.text}
+        write_fixture(path, fixture)
+
+        return response
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        return self.request('GET', url, params=params, headers=headers, timeout=timeout)
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        return self.request('POST', url, json=json, headers=headers, timeout=timeout)
+
+    def download(self, url, path, params=None):
+        response = self.request('GET', url, params=params)
+        response.raise_for_status()
+        with open(path, 'wb') as out_file:
+            out_file.write(response.content)
+
+    def close(self):
+        if self.record is not None:
+            self.record.close()
+
+
+def make_transport(fixture_dir=None, record=False, **kwargs):
+    '''
+        Returns the transport to be used for upstream API calls.
+
+        Parameters
+        ----------
+        fixture_dir: str
+            If provided, responses are replayed from this directory.
+
+        record: bool
+            If True, missing fixtures are fetched over the network and saved.
+
+
+        Returns
+        -------
+        HTTPTransport or ReplayTransport
+        '''
+    if fixture_dir is None:
+        return HTTPTransport(**kwargs)
+
+    return ReplayTransport(fixture_dir, record=HTTPTransport(**kwargs) if record else None)
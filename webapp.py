@@ -0,0 +1,198 @@
+#Imports
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Flask, abort, jsonify, make_response, render_template, request, send_file
+from werkzeug.security import safe_join
+
+from map_api import DatabaseUnavailable, MapAPI
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+STATIC_DIR = 'static'
+STATIC_MAX_AGE = 86400
+
+#Content encodings served from precompressed copies, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def precompress(paths):
+    '''
+        Writes gzip (and, if the brotli package is installed, Brotli) copies
+        of each file alongside it, as "<path>.gz" and "<path>.br".
+
+        Copies are only written for files changed since they were last compressed.
+        '''
+    for path in paths:
+        with open(path, 'rb') as source_file:
+            data = source_file.read()
+
+        compressors = {'.gz': lambda raw: gzip.compress(raw, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressors['.br'] = lambda raw: brotli.compress(raw, mode=brotli.MODE_TEXT)
+
+        for extension, compress in compressors.items():
+            target = path + extension
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                continue
+
+            with open(target + '.part', 'wb') as target_file:
+                target_file.write(compress(data))
+            os.replace(target + '.part', target)
+
+
+def send_static(static_dir, filename):
+    '''
+        Sends a static file, choosing its Brotli or gzip copy where the client
+        accepts it and the copy is current, with validators and a long
+        Cache-Control so that repeat requests can be answered with 304.
+        '''
+    path = safe_join(static_dir, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    #Precompressed copies are only served in place of their originals
+    for _, extension in ENCODINGS:
+        if path.endswith(extension) and os.path.isfile(path[:-len(extension)]):
+            abort(404)
+
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    encoding, variant = None, path
+    for name, extension in ENCODINGS:
+        candidate = path + extension
+        if (name in request.accept_encodings and os.path.exists(candidate)
+                and os.path.getmtime(candidate) >= os.path.getmtime(path)):
+            encoding, variant = name, candidate
+            break
+
+    response = send_file(variant, mimetype=mimetype, conditional=True, etag=True,
+                         last_modified=os.path.getmtime(path), max_age=STATIC_MAX_AGE)
+
+    response.headers.pop('Content-Disposition', None)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+
+    return response
+
+
+def create_app(static_dir=STATIC_DIR):
+    '''
+        Creates the web app.
+
+        Run it under a multi-worker WSGI server, e.g.
+        gunicorn --workers 4 "webapp:create_app()". The tile source and
+        market index are loaded by each worker on first use.
+
+        Parameters
+        ----------
+        static_dir: str
+            The directory holding the built maps and other static files.
+
+
+        Returns
+        -------
+        Flask
+        '''
+    app = Flask(__name__, static_folder=None)
+    static_dir = os.path.abspath(static_dir)
+
+    resources = {}
+    resources_lock = threading.Lock()
+
+    def resource(name):
+        with resources_lock:
+            if name not in resources:
+                if name == 'tiles':
+                    from tiles import TileSource
+                    resources[name] = TileSource()
+                elif name == 'map_api':
+                    resources[name] = MapAPI()
+                else:
+                    from nearest_markets import MarketIndex
+                    resources[name] = MarketIndex.from_layer()
+            return resources[name]
+
+    @app.errorhandler(DatabaseUnavailable)
+    def database_unavailable(error):
+        response = jsonify({'error': f'The map database is not available: {error}'})
+        response.status_code = 503
+        return response
+
+    @app.route('/')
+    def index():
+        return render_template('index.html')
+
+    @app.route('/static/<path:filename>')
+    def static(filename):
+        return send_static(static_dir, filename)
+
+    @app.route('/api/nearest')
+    def nearest():
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        k = request.args.get('k', default=1, type=int)
+
+        if lat is None or lon is None or not 1 <= k <= 25:
+            abort(400)
+
+        try:
+            markets = resource('market_index').nearest(lon, lat, k=k)
+        except ValueError:
+            abort(400)
+
+        return jsonify(markets)
+
+    @app.route('/api/markets')
+    def markets():
+        try:
+            collection = resource('map_api').markets(bbox=request.args.get('bbox'),
+                                                     shops=request.args.get('shop'))
+        except ValueError:
+            abort(400)
+
+        return jsonify(collection)
+
+    @app.route('/api/tracts/<geoid>')
+    def tract(geoid):
+        attributes = resource('map_api').tract(geoid)
+        if attributes is None:
+            abort(404)
+
+        return jsonify(attributes)
+
+    @app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>.pbf')
+    def tile(layer, z, x, y):
+        from tiles import MAX_ZOOM
+        if not (0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z):
+            abort(404)
+
+        try:
+            data = resource('tiles').get(layer, z, x, y)
+        except KeyError:
+            abort(404)
+
+        #Tiles are stored gzipped; decompress only for clients that cannot accept it
+        if 'gzip' in request.accept_encodings:
+            response = make_response(data)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = make_response(gzip.decompress(data))
+
+        response.headers['Content-Type'] = 'application/vnd.mapbox-vector-tile'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.set_etag(hashlib.md5(data).hexdigest())
+
+        return response.make_conditional(request)
+
+    return app